@@ -0,0 +1,117 @@
+import numpy as np
+
+KINDS = ("move", "above", "below")
+# Short windows are computed from the local price history rather than sent by CoinGecko
+WINDOW_PERIODS = {"5m": 300, "15m": 900, "30m": 1800}
+PERIOD_FIELDS = {
+    "1h": "change_1h", "24h": "change_24h", "7d": "change_7d",
+    **{period: f"change_{period}" for period in WINDOW_PERIODS},
+}
+# Columns of the per-tick value matrix: latest price, then one per period
+VALUE_FIELDS = ("usd",) + tuple(PERIOD_FIELDS.values())
+# A fired rule re-arms once the value falls back by this fraction of its threshold
+HYSTERESIS = {"move": 0.2, "above": 0.01, "below": 0.01}
+
+_KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+_FIELD_CODES = {period: VALUE_FIELDS.index(field) for period, field in PERIOD_FIELDS.items()}
+
+
+class AlertEngine:
+    """Evaluates every alert rule against a price snapshot in one array pass.
+
+    Rules are loaded as (rule_id, chat_id, coin, kind, threshold, period)
+    targets and held as parallel numpy columns. Each target keeps its own
+    armed flag so a rule fires once per crossing and re-arms only after the
+    value moves back past its hysteresis band.
+    """
+
+    def __init__(self):
+        self.coins = []
+        self.rule_ids = np.empty(0, dtype=np.int64)
+        self.chat_ids = np.empty(0, dtype=object)
+        self.coin_index = np.empty(0, dtype=np.int64)
+        self.kinds = np.empty(0, dtype=np.int8)
+        self.fields = np.empty(0, dtype=np.int64)
+        self.thresholds = np.empty(0, dtype=np.float64)
+        self.armed = np.empty(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.rule_ids)
+
+    def armed_state(self):
+        return {self.state_key(index): bool(armed) for index, armed in enumerate(self.armed)}
+
+    def load(self, targets, armed_state=None):
+        """Replace the rule set, keeping armed flags for targets seen before."""
+        previous = self.armed_state() if armed_state is None else armed_state
+        targets = [target for target in targets if target[3] in _KIND_CODES and target[5] in _FIELD_CODES]
+        self.coins = sorted({target[2] for target in targets})
+        positions = {coin: i for i, coin in enumerate(self.coins)}
+
+        self.rule_ids = np.fromiter((t[0] for t in targets), dtype=np.int64, count=len(targets))
+        self.chat_ids = np.array([t[1] for t in targets], dtype=object)
+        self.coin_index = np.fromiter((positions[t[2]] for t in targets), dtype=np.int64, count=len(targets))
+        self.kinds = np.fromiter((_KIND_CODES[t[3]] for t in targets), dtype=np.int8, count=len(targets))
+        self.thresholds = np.fromiter((t[4] for t in targets), dtype=np.float64, count=len(targets))
+        # Price levels compare against the latest price, moves against the period's change
+        self.fields = np.fromiter(
+            (0 if t[3] != "move" else _FIELD_CODES[t[5]] for t in targets),
+            dtype=np.int64, count=len(targets)
+        )
+        self.armed = np.fromiter(
+            (previous.get((t[0], t[2]), True) for t in targets), dtype=bool, count=len(targets)
+        )
+
+    def _value_matrix(self, snapshot):
+        values = np.full((len(self.coins), len(VALUE_FIELDS)), np.nan)
+        for i, coin in enumerate(self.coins):
+            data = snapshot.get(coin)
+            if data:
+                for j, field in enumerate(VALUE_FIELDS):
+                    value = data.get(field)
+                    if value is not None:
+                        values[i, j] = value
+        return values
+
+    def evaluate(self, snapshot):
+        """Return indices of targets that fired and update armed flags."""
+        if not len(self.rule_ids):
+            return np.empty(0, dtype=np.int64)
+        values = self._value_matrix(snapshot)[self.coin_index, self.fields]
+        known = ~np.isnan(values)
+        thresholds = self.thresholds
+
+        move = self.kinds == _KIND_CODES["move"]
+        above = self.kinds == _KIND_CODES["above"]
+        below = self.kinds == _KIND_CODES["below"]
+        with np.errstate(invalid="ignore"):
+            magnitude = np.abs(values)
+            triggered = (
+                (move & (magnitude >= thresholds))
+                | (above & (values >= thresholds))
+                | (below & (values <= thresholds))
+            )
+            rearm = (
+                (move & (magnitude < thresholds * (1 - HYSTERESIS["move"])))
+                | (above & (values < thresholds * (1 - HYSTERESIS["above"])))
+                | (below & (values > thresholds * (1 + HYSTERESIS["below"])))
+            )
+
+        fired = np.flatnonzero(self.armed & triggered & known)
+        self.armed[fired] = False
+        self.armed[~self.armed & rearm & known] = True
+        return fired
+
+    def state_key(self, index):
+        return int(self.rule_ids[index]), self.coins[self.coin_index[index]]
+
+    def target(self, index):
+        return {
+            "rule_id": int(self.rule_ids[index]),
+            "chat_id": self.chat_ids[index],
+            "coin": self.coins[self.coin_index[index]],
+            "kind": KINDS[self.kinds[index]],
+            "threshold": float(self.thresholds[index]),
+            "field": VALUE_FIELDS[self.fields[index]],
+            "period": VALUE_FIELDS[self.fields[index]].replace("change_", ""),
+        }
@@ -0,0 +1,383 @@
+"""Load-test harness for the scheduler, reminder and alert paths.
+
+Seeds a throwaway SQLite database with synthetic subscribers and runs the
+bot's own code against in-process fake Telegram Bot API and CoinGecko
+servers, reporting throughput, latency, DB queries, HTTP calls and peak
+memory per scenario:
+
+    python benchmark.py --users 1000 100000 --output baseline.json
+    python benchmark.py --users 1000 100000 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from aiohttp import web
+
+FAKE_HOST = "127.0.0.1"
+TELEGRAM_PORT = int(os.getenv("BENCH_TELEGRAM_PORT", "18401"))
+COINGECKO_PORT = int(os.getenv("BENCH_COINGECKO_PORT", "18402"))
+TIMEZONES = ["UTC", "Asia/Shanghai", "Asia/Tokyo", "Europe/Moscow", "America/New_York"]
+# Reminders in the reminder scenario are all due at this UTC minute
+DUE_MINUTE = 8 * 60
+SEED_BATCH = 50_000
+
+# The bot modules read these at import time
+os.environ["TELEGRAM_BASE_URL"] = f"http://{FAKE_HOST}:{TELEGRAM_PORT}/bot"
+os.environ["COINGECKO_API_URL"] = f"http://{FAKE_HOST}:{COINGECKO_PORT}/api/v3"
+os.environ["COINGECKO_REQUESTS_PER_MINUTE"] = "1000000"
+os.environ["MARKET_DATA_PROVIDERS"] = "coingecko"
+os.environ["PRICE_FEED"] = ""
+os.environ["REMINDER_CATCHUP_MINUTES"] = "0"
+# Keep synthetic coin history out of the bot's real ./price_history; removed at exit
+_history_dir = tempfile.TemporaryDirectory(prefix="bench_history_")
+os.environ["HISTORY_DIR"] = _history_dir.name
+
+import db
+from broadcast import Broadcaster, _percentile
+from crypto_utils import market_data, price_cache
+from reminder_bot import CryptoReminderBot
+
+logger = logging.getLogger("benchmark")
+
+
+class FakeBackends:
+    """Fake Telegram Bot API and CoinGecko servers that count every call."""
+
+    def __init__(self, coins, telegram_latency=0.0, seed=0):
+        self.coins = coins
+        self.telegram_latency = telegram_latency
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self.quotes = {coin: self._quote() for coin in coins}
+        self._runners = []
+
+    def _quote(self):
+        return {
+            "current_price": round(self._random.uniform(0.01, 50_000), 4),
+            "market_cap": self._random.randint(10**6, 10**12),
+            "price_change_percentage_1h_in_currency": self._random.uniform(-2, 2),
+            "price_change_percentage_24h": self._random.uniform(-10, 10),
+            "price_change_percentage_7d_in_currency": self._random.uniform(-20, 20),
+        }
+
+    def tick(self, volatility=0.5):
+        """Nudge every quote a little, as between two alert checks."""
+        for quote in self.quotes.values():
+            quote["current_price"] = round(quote["current_price"] * (1 + self._random.uniform(-0.001, 0.001)), 4)
+            quote["price_change_percentage_24h"] += self._random.uniform(-volatility, volatility)
+
+    def _market_row(self, coin):
+        return {"id": coin, "symbol": coin[:4], "name": coin.title(), "image": "", **self.quotes[coin]}
+
+    async def coingecko_markets(self, request):
+        self.calls["coingecko:/coins/markets"] += 1
+        ids = request.query.get("ids")
+        if ids:
+            return web.json_response([self._market_row(coin) for coin in ids.split(",") if coin in self.quotes])
+        per_page = int(request.query.get("per_page", 100))
+        page = int(request.query.get("page", 1))
+        return web.json_response([self._market_row(coin) for coin in self.coins[(page - 1) * per_page:page * per_page]])
+
+    async def telegram_method(self, request):
+        method = request.match_info["method"]
+        self.calls[f"telegram:{method}"] += 1
+        data = await request.json() if request.content_type == "application/json" else await request.post()
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}})
+        if method == "sendMessage":
+            if self.telegram_latency:
+                await asyncio.sleep(self.telegram_latency)
+            chat_id = int(data["chat_id"])
+            return web.json_response({"ok": True, "result": {
+                "message_id": self.calls[f"telegram:{method}"], "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", "")
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _serve(self, app, port):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, FAKE_HOST, port).start()
+        self._runners.append(runner)
+
+    async def start(self):
+        telegram = web.Application()
+        telegram.router.add_post("/bot{token}/{method}", self.telegram_method)
+        coingecko = web.Application()
+        coingecko.router.add_get("/api/v3/coins/markets", self.coingecko_markets)
+        await self._serve(telegram, TELEGRAM_PORT)
+        await self._serve(coingecko, COINGECKO_PORT)
+
+    async def stop(self):
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners = []
+
+
+class RecordingBroadcaster(Broadcaster):
+    """Broadcaster without Telegram's rate limits that keeps its reports."""
+
+    def __init__(self, bot, on_blocked=None, workers=10):
+        super().__init__(bot, workers=workers, global_rate=1e9, per_chat_interval=0, on_blocked=on_blocked)
+        self.reports = []
+
+    async def send_many(self, messages, delivered=None):
+        report = await super().send_many(messages, delivered)
+        self.reports.append(report)
+        return report
+
+
+class Probe:
+    """Counts DB statements, fake backend calls and peak traced memory."""
+
+    def __init__(self, backends, trace_memory=True):
+        self.backends = backends
+        self.trace_memory = trace_memory
+        self.queries = 0
+
+    def _on_query(self, statement):
+        self.queries += 1
+
+    def attach(self):
+        db.get_connection().set_trace_callback(self._on_query)
+
+    def start(self):
+        self.queries = 0
+        self._calls = Counter(self.backends.calls)
+        if self.trace_memory:
+            tracemalloc.start()
+
+    def stop(self):
+        peak = None
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        calls = self.backends.calls - self._calls
+        return {
+            "db_queries": self.queries,
+            "http_calls": sum(calls.values()),
+            "http_calls_by_endpoint": dict(calls),
+            "peak_memory_mb": round(peak / 2**20, 2) if peak is not None else None,
+        }
+
+
+async def measure(name, probe, scenario, repeat=1):
+    """Run scenario() `repeat` times and return its metrics.
+
+    A scenario returns {"ops": n} plus, for send paths, the broadcaster's
+    per-message latencies; otherwise latency is the per-run duration.
+    """
+    durations = []
+    ops = 0
+    latencies = {}
+    probe.start()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = await scenario()
+            durations.append(time.perf_counter() - started)
+            ops += result.get("ops", 0)
+            latencies = {key: result[key] for key in ("latency_p50", "latency_p99") if key in result} or latencies
+    finally:
+        counters = probe.stop()
+    duration = sum(durations)
+    metrics = {
+        "runs": repeat,
+        "duration": duration,
+        "ops": ops,
+        "throughput": ops / duration if duration else 0.0,
+        "latency_p50": latencies.get("latency_p50", _percentile(durations, 50)),
+        "latency_p99": latencies.get("latency_p99", _percentile(durations, 99)),
+        **counters,
+    }
+    logger.info(
+        f"{name:>14}: {ops} ops in {duration:.3f}s ({metrics['throughput']:,.0f}/s), "
+        f"p50 {metrics['latency_p50'] * 1000:.1f} ms, p99 {metrics['latency_p99'] * 1000:.1f} ms, "
+        f"{metrics['db_queries']} queries, {metrics['http_calls']} HTTP calls, {metrics['peak_memory_mb'] or '-'} MB peak"
+    )
+    return metrics
+
+
+def seed_users(count, coins, due_fraction, coins_per_user=3, seed=0):
+    """Bulk-insert synthetic users, bypassing save_user's per-row commit."""
+    rng = random.Random(seed)
+    offsets = {tz: db.utc_offset_minutes(tz) for tz in TIMEZONES}
+    conn = db.get_connection()
+    due = int(count * due_fraction)
+    for start in range(0, count, SEED_BATCH):
+        users, holdings, rules = [], [], []
+        for i in range(start, min(start + SEED_BATCH, count)):
+            user_id = str(100_000 + i)
+            tz = TIMEZONES[i % len(TIMEZONES)]
+            utc = DUE_MINUTE if i < due else (DUE_MINUTE + 1 + rng.randrange(1439)) % 1440
+            local = (utc + offsets[tz]) % 1440
+            users.append((user_id, f"{local // 60:02d}:{local % 60:02d}", tz, utc))
+            for position, coin in enumerate(rng.sample(coins, coins_per_user)):
+                holdings.append((user_id, coin, position))
+            rules.append((user_id, *db.DEFAULT_ALERT_RULE))
+        with db._lock, conn:
+            conn.executemany(
+                "INSERT INTO users (user_id, notification_time, timezone, utc_minute, active) VALUES (?, ?, ?, ?, 1)",
+                users
+            )
+            conn.executemany("INSERT INTO user_coins (user_id, coin, position) VALUES (?, ?, ?)", holdings)
+            conn.executemany(
+                "INSERT INTO alert_rules (user_id, coin, kind, threshold, period) VALUES (?, ?, ?, ?, ?)", rules
+            )
+    return {"ops": count}
+
+
+async def run_size(users, args, backends, workdir):
+    db.close_db()
+    db.DB_PATH = os.path.join(workdir, f"bench_{users}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db.DB_PATH + suffix):
+            os.remove(db.DB_PATH + suffix)
+    db.init_db()
+    probe = Probe(backends, trace_memory=not args.no_tracemalloc)
+    probe.attach()
+    logger.info(f"--- {users:,} users ---")
+
+    bot = CryptoReminderBot("1:benchmark")
+    bot.broadcaster = RecordingBroadcaster(bot.app.bot, on_blocked=bot._deactivate_chat, workers=args.workers)
+    await bot.app.initialize()
+    results = {}
+    try:
+        results["seed"] = await measure(
+            "seed", probe, lambda: db.run_db(seed_users, users, backends.coins, args.due_fraction)
+        )
+
+        async def startup():
+            await db.run_db(db.init_db)
+            return {"ops": users}
+        results["startup"] = await measure("startup", probe, startup)
+
+        async def setup_jobs():
+            await bot.post_init(bot.app)
+            return {"ops": 1}
+        results["setup_jobs"] = await measure("setup_jobs", probe, setup_jobs, repeat=3)
+
+        async def save_user():
+            latencies = []
+            for i in range(args.writes):
+                started = time.perf_counter()
+                await db.run_db(db.save_user, str(90_000 + i), "UTC", backends.coins[:3], "09:30")
+                latencies.append(time.perf_counter() - started)
+            return {
+                "ops": args.writes,
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p99": _percentile(latencies, 99),
+            }
+        results["save_user"] = await measure("save_user", probe, save_user)
+
+        async def reminders():
+            price_cache.clear()
+            due = await db.run_db(db.get_users_by_utc_minute, DUE_MINUTE)
+            report = await bot._send_reminders(due)
+            return {"ops": report["sent"], "latency_p50": report["latency_p50"], "latency_p99": report["latency_p99"]}
+        results["reminders"] = await measure("reminders", probe, reminders)
+
+        async def alerts():
+            price_cache.clear()
+            sent_before = len(bot.broadcaster.reports)
+            await bot.price_alert_monitor(None)
+            reports = bot.broadcaster.reports[sent_before:]
+            result = {"ops": len(bot.alert_engine)}
+            if reports:
+                result.update(latency_p50=reports[-1]["latency_p50"], latency_p99=reports[-1]["latency_p99"])
+            return result
+        results["alerts_cold"] = await measure("alerts_cold", probe, alerts)
+        backends.tick()
+        results["alerts_steady"] = await measure("alerts_steady", probe, alerts)
+    finally:
+        await bot.app.shutdown()
+        await market_data.close()
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """Print throughput and p99 changes against a saved run; return regressions."""
+    regressions = []
+    for size, scenarios in current["results"].items():
+        for name, metrics in scenarios.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not before:
+                continue
+            for key, higher_is_better in (("throughput", True), ("latency_p99", False), ("db_queries", False),
+                                          ("http_calls", False), ("peak_memory_mb", False)):
+                old, new = before.get(key), metrics.get(key)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = change < -tolerance if higher_is_better else change > tolerance
+                marker = "  REGRESSION" if worse else ""
+                print(f"{size:>9} {name:>14} {key:>15}: {old:>12.4g} -> {new:>12.4g} ({change:+.1%}){marker}")
+                if worse:
+                    regressions.append((size, name, key))
+    return regressions
+
+
+async def main(args):
+    coins = [f"coin-{i:04d}" for i in range(args.coins)]
+    backends = FakeBackends(coins, telegram_latency=args.telegram_latency / 1000, seed=args.seed)
+    await backends.start()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for users in args.users:
+                results[str(users)] = await run_size(users, args, backends, workdir)
+            await db.run_db(db.close_db)
+    finally:
+        await backends.stop()
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "coins": args.coins,
+            "telegram_latency_ms": args.telegram_latency,
+            "tracemalloc": not args.no_tracemalloc,
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10_000], help="subscriber counts to test")
+    parser.add_argument("--coins", type=int, default=500, help="size of the synthetic coin universe")
+    parser.add_argument("--due-fraction", type=float, default=0.1, help="share of users due in the reminder run")
+    parser.add_argument("--writes", type=int, default=200, help="save_user calls in the write scenario")
+    parser.add_argument("--workers", type=int, default=10, help="broadcast worker pool size")
+    parser.add_argument("--telegram-latency", type=float, default=5.0, help="fake sendMessage latency in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-tracemalloc", action="store_true", help="skip memory tracing, which slows runs down")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against a previous results file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    report = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        sys.exit(1 if regressions else 0)
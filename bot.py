@@ -1,12 +1,23 @@
-from reminder_bot import CryptoReminderBot
 import os
 from dotenv import load_dotenv
 
+# The bot's modules read their settings at import, so .env has to be loaded first
 load_dotenv()
+
+from reminder_bot import (  # noqa: E402
+    CryptoReminderBot, TELEGRAM_BASE_URL, WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL
+)
+from sharding import run_sharded  # noqa: E402
 BOT_TOKEN = os.getenv("BOT_TOKEN") 
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", "1"))
 
 if __name__ == "__main__":
-    bot = CryptoReminderBot(BOT_TOKEN)
-    bot.run()
-
-
+    if BOT_SHARDS > 1:
+        webhook = {
+            "listen": WEBHOOK_LISTEN, "port": WEBHOOK_PORT, "path": WEBHOOK_PATH,
+            "secret": WEBHOOK_SECRET or None, "url": WEBHOOK_URL or None
+        } if WEBHOOK_PORT else None
+        run_sharded(BOT_TOKEN, BOT_SHARDS, base_url=TELEGRAM_BASE_URL or None, webhook=webhook)
+    else:
+        bot = CryptoReminderBot(BOT_TOKEN)
+        bot.run()
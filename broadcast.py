@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from telegram.error import Forbidden, NetworkError, RetryAfter, TelegramError
+from rate_limit import TokenBucket
+from metrics import chats_blocked, message_retries, messages_sent, send_latency
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second overall and one per second per chat
+GLOBAL_RATE = 30
+PER_CHAT_INTERVAL = 1.0
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Broadcaster:
+    """Sends batches of messages through a bounded, rate-limited worker pool.
+
+    RetryAfter responses are honoured, transient network errors are retried
+    with exponential backoff, and chats that blocked the bot are passed to
+    `on_blocked` so they can be marked inactive.
+    """
+
+    def __init__(self, bot, workers=10, global_rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 max_retries=3, backoff=1.0, on_blocked=None):
+        self.bot = bot
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_blocked = on_blocked
+        self._bucket = TokenBucket(global_rate)
+        self._chat_next_send = {}
+
+    async def _wait_for_chat(self, chat_id):
+        now = time.monotonic()
+        next_send = self._chat_next_send.get(chat_id, now)
+        self._chat_next_send[chat_id] = max(now, next_send) + self.per_chat_interval
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+
+    def _prune_chat_limits(self):
+        now = time.monotonic()
+        self._chat_next_send = {
+            chat_id: next_send for chat_id, next_send in self._chat_next_send.items() if next_send > now
+        }
+
+    async def _send(self, chat_id, text, stats):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self._bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                stats["retried"] += 1
+                message_retries.inc("flood_control")
+                logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except Forbidden as e:
+                stats["blocked"] += 1
+                chats_blocked.inc()
+                logger.info(f"Chat {chat_id} blocked the bot: {e}")
+                if self.on_blocked:
+                    await self.on_blocked(chat_id)
+                return False
+            except NetworkError as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Failed to send message to chat {chat_id}: {e}")
+                    break
+                stats["retried"] += 1
+                message_retries.inc("network")
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Network error sending to chat {chat_id}, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+            except TelegramError as e:
+                logger.error(f"Failed to send message to chat {chat_id}: {e}")
+                return False
+        logger.error(f"Giving up on chat {chat_id} after {self.max_retries} retries")
+        return False
+
+    async def _worker(self, queue, stats, latencies, delivered):
+        while True:
+            item = await queue.get()
+            try:
+                chat_id, text, enqueued_at = item
+                if await self._send(chat_id, text, stats):
+                    stats["sent"] += 1
+                    messages_sent.inc("sent")
+                    latency = time.monotonic() - enqueued_at
+                    latencies.append(latency)
+                    send_latency.observe(latency)
+                    if delivered is not None:
+                        delivered.append(chat_id)
+                else:
+                    stats["failed"] += 1
+                    messages_sent.inc("failed")
+            except Exception as e:
+                stats["failed"] += 1
+                messages_sent.inc("failed")
+                logger.error(f"Unexpected error in broadcast worker: {e}")
+            finally:
+                queue.task_done()
+
+    async def send_many(self, messages, delivered=None):
+        """Deliver (chat_id, text) pairs and return delivery statistics.
+
+        Chat ids that were delivered successfully are appended to `delivered`
+        when a list is given.
+        """
+        started = time.monotonic()
+        queue = asyncio.Queue()
+        for chat_id, text in messages:
+            queue.put_nowait((chat_id, text, started))
+        stats = {"sent": 0, "failed": 0, "blocked": 0, "retried": 0}
+        if queue.empty():
+            return {**stats, "duration": 0.0, "throughput": 0.0, "latency_p50": 0.0, "latency_p99": 0.0}
+
+        latencies = []
+        workers = [
+            asyncio.create_task(self._worker(queue, stats, latencies, delivered))
+            for _ in range(min(self.workers, queue.qsize()))
+        ]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._prune_chat_limits()
+
+        duration = time.monotonic() - started
+        return {
+            **stats,
+            "duration": duration,
+            "throughput": stats["sent"] / duration if duration else 0.0,
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p99": _percentile(latencies, 99),
+        }
@@ -0,0 +1,69 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency until it has had time to recover.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    callers skip the dependency. Once `reset_timeout` has passed a single
+    trial call is let through (half-open): success closes the breaker,
+    failure re-opens it with the timeout doubled, up to `max_reset_timeout`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0, max_reset_timeout=600.0, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.on_change = on_change
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._state = self.CLOSED
+
+    @property
+    def state(self):
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def _set_state(self, state):
+        if state != self._state:
+            logger.warning(f"Circuit {self.name} is now {state}")
+            self._state = state
+            if self.on_change:
+                self.on_change(self)
+
+    def allow(self):
+        """Return True if a call may go through, claiming the trial slot when half-open."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self._trial_running = False
+        self.failures = 0
+        self.reset_timeout = self.base_reset_timeout
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        was_trial = self._trial_running
+        self._trial_running = False
+        self.failures += 1
+        if was_trial:
+            self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+        if was_trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
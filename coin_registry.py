@@ -0,0 +1,71 @@
+import logging
+import time
+from crypto_utils import market_data
+from db import get_coins, save_coins, run_db
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_SIZE = 1000
+REFRESH_INTERVAL = 6 * 60 * 60
+
+
+class CoinRegistry:
+    """In-memory index of the tracked coin universe, persisted in SQLite.
+
+    Lookups accept a CoinGecko id, a ticker symbol or a coin name. When
+    several coins share a symbol or name, the one with the largest market
+    cap wins.
+    """
+
+    def __init__(self, size=REGISTRY_SIZE):
+        self.size = size
+        self.loaded_at = None
+        self._ranked = []
+        self._ids = set()
+        self._symbols = {}
+        self._names = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, coin_id):
+        return coin_id in self._ids
+
+    def _index(self, coins):
+        self._ranked = [coin['id'] for coin in coins]
+        self._ids = set(self._ranked)
+        self._symbols = {}
+        self._names = {}
+        for coin in coins:
+            self._symbols.setdefault(coin['symbol'].lower(), coin['id'])
+            self._names.setdefault(coin['name'].lower(), coin['id'])
+        self.loaded_at = time.time()
+
+    def load(self):
+        coins = get_coins()
+        if coins:
+            self._index(coins)
+            logger.info(f"Loaded {len(coins)} coins from the local registry")
+        return len(coins)
+
+    async def refresh(self):
+        coins = await market_data.get_top_coin_details(self.size)
+        if not coins:
+            logger.warning("Coin registry refresh returned no coins, keeping the current index")
+            return False
+        self._index(coins)
+        await run_db(save_coins, coins)
+        logger.info(f"Coin registry refreshed with {len(coins)} coins")
+        return True
+
+    def resolve(self, token):
+        token = token.strip().lower()
+        if token in self._ids:
+            return token
+        return self._symbols.get(token) or self._names.get(token)
+
+    def top(self, limit=10):
+        return self._ranked[:limit]
+
+
+coin_registry = CoinRegistry()
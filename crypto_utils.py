@@ -1,47 +1,410 @@
 # crypto_utils.py
-import requests
-import json
+import asyncio
+import logging
 import os
+import time
+from collections import OrderedDict
+import httpx
+from circuit_breaker import CircuitBreaker
+from db import subscriber_index
+from price_cache import PriceCache
+from price_store import PriceStore
+from history_store import HistoryStore
+from rate_limit import TokenBucket
+from metrics import registry, stale_quotes, upstream_circuit_open, upstream_errors, upstream_latency
 
 SUBSCRIBER_FILE = "subscribers.json"
+COINGECKO_API_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "60"))
+PRICE_CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "5000"))
+REQUESTS_PER_MINUTE = int(os.getenv("COINGECKO_REQUESTS_PER_MINUTE", "30"))
+COINCAP_API_URL = os.getenv("COINCAP_API_URL", "https://api.coincap.io/v2")
+# Providers in failover order; each request goes to the first one whose circuit is closed
+MARKET_DATA_PROVIDERS = os.getenv("MARKET_DATA_PROVIDERS", "coingecko,coincap")
+# How old a last-good quote may be and still be served, marked stale, during an outage
+STALE_MAX_AGE = float(os.getenv("STALE_MAX_AGE", "3600"))
+# CoinGecko ids that CoinCap names differently; most ids match. Extend with
+# COINCAP_ID_OVERRIDES="coingecko-id:coincap-id,..."
+COINCAP_IDS = {
+    "binancecoin": "binance-coin",
+    "ripple": "xrp",
+    "avalanche-2": "avalanche",
+    "matic-network": "polygon",
+    "dai": "multi-collateral-dai",
+    "crypto-com-chain": "crypto-com-coin",
+    "theta-token": "theta",
+    "quant-network": "quant",
+    "leo-token": "unus-sed-leo",
+    "pancakeswap-token": "pancakeswap",
+    "the-open-network": "toncoin",
+}
+COINCAP_IDS.update(
+    pair.split(":", 1) for pair in os.getenv("COINCAP_ID_OVERRIDES", "").split(",") if ":" in pair
+)
+_COINGECKO_IDS = {coincap: coingecko for coingecko, coincap in COINCAP_IDS.items()}
+# coins/markets returns at most 250 rows per page
+MARKETS_PAGE_SIZE = 250
+MAX_IDS_LENGTH = 2000
 
-def get_price(coin_ids):
-    url = "https://api.coingecko.com/api/v3/coins/markets"
-    params = {
-        'vs_currency': 'usd',
-        'ids': coin_ids,
-        'order': 'market_cap_desc'
-    }
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+logger = logging.getLogger(__name__)
 
+
+class MarketDataClient:
+    """Async CoinGecko client sharing one keep-alive connection pool."""
+
+    name = "coingecko"
+
+    def __init__(self, base_url=COINGECKO_API_URL, timeout=10.0, max_connections=10, max_concurrency=5,
+                 requests_per_minute=REQUESTS_PER_MINUTE):
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        )
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._budget = TokenBucket(requests_per_minute / 60, capacity=max_concurrency)
+        self._client = None
+
+    def share_budget(self, processes):
+        """Spend only this process's share of the request budget when several processes call the API."""
+        self._budget = TokenBucket(
+            self.requests_per_minute / processes / 60, capacity=max(1, self.max_concurrency // processes)
+        )
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits
+            )
+        return self._client
+
+    async def _get(self, path, params):
+        await self._budget.acquire()
+        try:
+            async with self._semaphore:
+                with upstream_latency.time(path):
+                    response = await self._get_client().get(path, params=params)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            # Label by status or exception type so error messages don't explode cardinality
+            reason = f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError) else type(e).__name__
+            upstream_errors.inc(path, reason)
+            raise
+
+    async def _fetch_markets(self, coin_ids):
+        params = {
+            'vs_currency': 'usd',
+            'ids': ",".join(coin_ids),
+            'order': 'market_cap_desc',
+            'per_page': len(coin_ids),
+            'page': 1,
+            'price_change_percentage': '1h,24h,7d'
+        }
+        data = await self._get("/coins/markets", params)
         result = {}
         for coin in data:
             result[coin['id']] = {
                 'usd': coin['current_price'],
                 'market_cap': coin['market_cap'],
                 'change_24h': coin['price_change_percentage_24h'],
+                'change_1h': coin.get('price_change_percentage_1h_in_currency'),
+                'change_7d': coin.get('price_change_percentage_7d_in_currency'),
                 'logo': coin['image']
             }
         return result
-    except requests.RequestException as e:
-        print(f"Failed to fetch prices: {e}")
+
+    async def get_prices_bulk(self, coin_ids):
+        """Fetch quotes for any number of coins in concurrent page-sized chunks.
+
+        Returns the merged snapshot and a list of {"ids", "error"} entries for
+        chunks that failed, so one bad chunk doesn't discard the rest.
+        """
+        chunks = _chunk_ids(coin_ids)
+        results = await asyncio.gather(
+            *(self._fetch_markets(chunk) for chunk in chunks),
+            return_exceptions=True
+        )
+        snapshot = {}
+        failures = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, (httpx.HTTPError, ValueError)):
+                error = _describe_error(result)
+                logger.error(f"Failed to fetch prices for {len(chunk)} coins ({chunk[0]}..{chunk[-1]}): {error}")
+                failures.append({"ids": chunk, "error": error})
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                snapshot.update(result)
+        return snapshot, failures
+
+    async def get_price(self, coin_ids):
+        snapshot, _ = await self.get_prices_bulk(_split_ids(coin_ids))
+        return snapshot
+
+    async def get_top_coin_details(self, limit=1000):
+        pages = range(1, (limit + MARKETS_PAGE_SIZE - 1) // MARKETS_PAGE_SIZE + 1)
+        params = [
+            {
+                "vs_currency": "usd",
+                "order": "market_cap_desc",
+                "per_page": min(MARKETS_PAGE_SIZE, limit),
+                "page": page,
+                "sparkline": "false"
+            } for page in pages
+        ]
+        try:
+            results = await asyncio.gather(*(self._get("/coins/markets", page) for page in params))
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Failed to fetch top coins: {_describe_error(e)}")
+            return []
+        return [
+            {'id': coin['id'], 'symbol': coin['symbol'], 'name': coin['name']}
+            for page in results for coin in page
+        ][:limit]
+
+    async def get_top_coins(self, limit=1000):
+        return [coin['id'] for coin in await self.get_top_coin_details(limit)]
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def to_coincap_id(coin_id):
+    return COINCAP_IDS.get(coin_id, coin_id)
+
+
+def from_coincap_id(asset_id):
+    return _COINGECKO_IDS.get(asset_id, asset_id)
+
+
+class CoinCapClient(MarketDataClient):
+    """CoinCap client used for failover; it has no 1h/7d changes or logos.
+
+    Takes and returns CoinGecko ids, translating through COINCAP_IDS.
+    """
+
+    name = "coincap"
+
+    def __init__(self, base_url=COINCAP_API_URL, **kwargs):
+        super().__init__(base_url, **kwargs)
+
+    async def _fetch_markets(self, coin_ids):
+        ids = [to_coincap_id(coin) for coin in coin_ids]
+        data = await self._get("/assets", {"ids": ",".join(ids), "limit": len(ids)})
+        return {
+            from_coincap_id(asset['id']): {
+                'usd': float(asset['priceUsd']),
+                'market_cap': float(asset.get('marketCapUsd') or 0),
+                'change_24h': float(asset.get('changePercent24Hr') or 0),
+                'change_1h': None,
+                'change_7d': None,
+                'logo': None
+            }
+            for asset in data['data'] if asset.get('priceUsd')
+        }
+
+    async def get_top_coin_details(self, limit=1000):
+        try:
+            data = await self._get("/assets", {"limit": min(limit, 2000)})
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Failed to fetch top coins from CoinCap: {_describe_error(e)}")
+            return []
+        return [
+            {'id': from_coincap_id(asset['id']), 'symbol': asset['symbol'].lower(), 'name': asset['name']}
+            for asset in data['data']
+        ][:limit]
+
+
+class ResilientMarketData:
+    """Routes market data calls through per-provider circuit breakers.
+
+    Providers are tried in order, skipping any whose circuit is open, and
+    coins one provider could not price are retried on the next. Coins no
+    provider could serve fall back to their last good quote, marked with
+    stale=True and an as_of timestamp. Failed calls are never retried
+    inline; the breaker's doubling reset timeout is the backoff, so an
+    outage costs one probe per timeout instead of a pile of retries.
+
+    The top coin list, which becomes the coin registry, only ever comes
+    from the primary provider: fallback ids are not guaranteed to match, so
+    during an outage the last good list is served instead.
+    """
+
+    def __init__(self, providers, stale_max_age=STALE_MAX_AGE, max_last_good=PRICE_CACHE_SIZE):
+        self.providers = providers
+        self.stale_max_age = stale_max_age
+        self.max_last_good = max_last_good
+        self.breakers = {
+            provider.name: CircuitBreaker(provider.name, on_change=_report_circuit) for provider in providers
+        }
+        self._last_good = OrderedDict()
+        self._last_top = []
+
+    async def get_prices_bulk(self, coin_ids):
+        remaining = list(coin_ids)
+        snapshot = {}
+        failures = []
+        attempted = False
+        for provider in self.providers:
+            if not remaining:
+                break
+            breaker = self.breakers[provider.name]
+            if not breaker.allow():
+                continue
+            attempted = True
+            try:
+                found, failed = await provider.get_prices_bulk(remaining)
+            except Exception as e:
+                logger.error(f"{provider.name} price request failed: {_describe_error(e)}")
+                found, failed = {}, [{"ids": remaining, "error": _describe_error(e)}]
+            except BaseException:
+                # e.g. cancellation; a half-open breaker must not keep its trial slot claimed
+                breaker.record_failure()
+                raise
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            snapshot.update(found)
+            failures.extend(failed)
+            remaining = [coin for coin in remaining if coin not in found]
+
+        now = time.time()
+        for coin, data in snapshot.items():
+            self._last_good[coin] = (now, data)
+            self._last_good.move_to_end(coin)
+        while len(self._last_good) > self.max_last_good:
+            self._last_good.popitem(last=False)
+        if not attempted and remaining:
+            failures = [{"ids": remaining, "error": "all providers unavailable"}]
+        failed_ids = {coin for failure in failures for coin in failure["ids"]}
+        for coin in remaining:
+            entry = self._last_good.get(coin)
+            if coin in failed_ids and entry and now - entry[0] <= self.stale_max_age:
+                snapshot[coin] = {**entry[1], 'stale': True, 'as_of': entry[0]}
+                stale_quotes.inc()
+        # Report each coin that ended up without any quote once, under its latest error
+        unserved = {coin for coin in remaining if coin not in snapshot}
+        reported = []
+        for failure in reversed(failures):
+            ids = [coin for coin in failure["ids"] if coin in unserved]
+            unserved.difference_update(ids)
+            if ids:
+                reported.append({**failure, "ids": ids})
+        return snapshot, reported
+
+    async def get_price(self, coin_ids):
+        snapshot, _ = await self.get_prices_bulk(_split_ids(coin_ids))
+        return snapshot
+
+    async def get_top_coin_details(self, limit=1000):
+        provider = self.providers[0]
+        breaker = self.breakers[provider.name]
+        if breaker.allow():
+            try:
+                coins = await provider.get_top_coin_details(limit)
+            except Exception as e:
+                logger.error(f"{provider.name} top coins request failed: {_describe_error(e)}")
+                coins = []
+            except BaseException:
+                breaker.record_failure()
+                raise
+            if coins:
+                breaker.record_success()
+                self._last_top = coins
+                return coins
+            breaker.record_failure()
+        if self._last_top:
+            logger.warning(f"{provider.name} unavailable, serving the last top coin list")
+        return self._last_top[:limit]
+
+    async def get_top_coins(self, limit=1000):
+        return [coin['id'] for coin in await self.get_top_coin_details(limit)]
+
+    def share_budget(self, processes):
+        for provider in self.providers:
+            provider.share_budget(processes)
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.close()
+
+
+def _report_circuit(breaker):
+    upstream_circuit_open.set(int(breaker.state != CircuitBreaker.CLOSED), breaker.name)
+
+
+def _split_ids(coin_ids):
+    if isinstance(coin_ids, str):
+        coin_ids = coin_ids.split(",")
+    return list(dict.fromkeys(coin.strip() for coin in coin_ids if coin.strip()))
+
+
+def _describe_error(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}"
+    return str(error) or type(error).__name__
+
+
+def _chunk_ids(coin_ids, size=MARKETS_PAGE_SIZE, max_chars=MAX_IDS_LENGTH):
+    # Split by page size and by query-string length, whichever is hit first
+    chunks = []
+    chunk = []
+    length = 0
+    for coin in coin_ids:
+        if chunk and (len(chunk) >= size or length + len(coin) + 1 > max_chars):
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        chunk.append(coin)
+        length += len(coin) + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+_PROVIDERS = {"coingecko": MarketDataClient, "coincap": CoinCapClient}
+market_data = ResilientMarketData([
+    _PROVIDERS[name.strip()]() for name in MARKET_DATA_PROVIDERS.split(",") if name.strip()
+])
+price_cache = PriceCache(ttl=PRICE_CACHE_TTL, max_size=PRICE_CACHE_SIZE)
+# Filled by price_feed.PriceFeed when a streaming or polling feed is enabled
+price_store = PriceStore()
+# Every fetched or streamed quote of a tracked coin is appended here for /history, /chart and windowed alerts
+price_history = HistoryStore()
+
+registry.gauge("price_cache_hit_ratio", "Share of quote lookups served from the cache.",
+               callback=lambda: price_cache.stats()["hit_ratio"])
+registry.gauge("price_cache_entries", "Quotes currently cached.", callback=lambda: price_cache.stats()["size"])
+registry.gauge("price_store_entries", "Quotes held by the price feed store.", callback=lambda: len(price_store))
+
+
+async def get_price(coin_ids):
+    ids = _split_ids(coin_ids)
+    if not ids:
         return {}
+    result, missing = price_store.get_many(ids)
+    if missing:
+        result.update(await price_cache.get_many(missing, _fetch_and_record))
+    return result
+
+
+async def _fetch_and_record(coin_ids):
+    prices = await market_data.get_price(coin_ids)
+    # Ad-hoc /price lookups would otherwise claim a history row per coin ever asked about
+    price_history.record({
+        coin: data for coin, data in prices.items() if not data.get('stale') and coin in subscriber_index
+    })
+    return prices
+
 
-def get_top_coins(limit=1000):
-    url = "https://api.coingecko.com/api/v3/coins/markets"
-    params = {
-        "vs_currency": "usd",
-        "order": "market_cap_desc",
-        "per_page": limit,
-        "page": 1,
-        "sparkline": "false"
-    }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        coins = response.json()
-        return [coin['id'] for coin in coins]
-    else:
-        return []
+async def get_top_coins(limit=1000):
+    return await market_data.get_top_coins(limit)
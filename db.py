@@ -1,64 +1,530 @@
+import asyncio
+import functools
+import json
+import logging
+import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pytz
+from subscriber_index import SubscriberIndex
+from metrics import db_call_latency
 
-def init_db():
-    conn = sqlite3.connect("crypto_bot.db")
-    c = conn.cursor()
+DB_PATH = os.getenv("DB_PATH", "crypto_bot.db")
+SCHEMA_VERSION = 4
+
+# Every new subscriber starts with the original global alert: a 5% move over 24h
+DEFAULT_ALERT_RULE = (None, "move", 5.0, "24h")
+
+logger = logging.getLogger(__name__)
+
+# One long-lived connection shared by a single-thread executor; SQLite
+# serialises writers anyway, and keeping the connection open lets it reuse
+# its prepared statement cache.
+_conn = None
+_lock = threading.RLock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+# Coin -> chat ids for active users tracking it, through their coin list or an alert rule,
+# kept in step with every write below
+subscriber_index = SubscriberIndex()
+# Bumped on every subscription or alert rule write so caches can tell when to reload
+_subscriptions_version = 0
+
+
+def subscriptions_version():
+    return _subscriptions_version
+
+def _bump_subscriptions_version():
+    global _subscriptions_version
+    _subscriptions_version += 1
+
+
+def get_connection():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            _conn.execute("PRAGMA foreign_keys=ON")
+        return _conn
+
+def close_db():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def _timed(func, *args, **kwargs):
+    with db_call_latency.time(func.__name__):
+        return func(*args, **kwargs)
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking db function on the storage executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(_timed, func, *args, **kwargs))
+
+def _create_schema(c):
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id TEXT PRIMARY KEY,
             notification_time TEXT,
-            currencies TEXT,
-            timezone TEXT
+            timezone TEXT,
+            utc_minute INTEGER,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_coins (
+            user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            coin TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (user_id, coin)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS coins (
+            coin_id TEXT PRIMARY KEY,
+            symbol TEXT,
+            name TEXT,
+            rank INTEGER
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            coin TEXT,
+            kind TEXT NOT NULL,
+            threshold REAL NOT NULL,
+            period TEXT NOT NULL DEFAULT '24h'
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS alert_state (
+            rule_id INTEGER NOT NULL REFERENCES alert_rules (rule_id) ON DELETE CASCADE,
+            coin TEXT NOT NULL,
+            fired_at TEXT NOT NULL,
+            PRIMARY KEY (rule_id, coin)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS deliveries (
+            user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            kind TEXT NOT NULL,
+            delivered_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, kind)
         )
     ''')
-    conn.commit()
-    conn.close()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_coins_coin ON user_coins (coin)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alert_rules_user ON alert_rules (user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_utc_minute ON users (utc_minute)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_notification_time ON users (notification_time)")
+
+def _migrate_legacy_users(c):
+    # Version 0 stored coins as a comma-joined users.currencies column
+    columns = [row[1] for row in c.execute("PRAGMA table_info(users)")]
+    if "currencies" not in columns:
+        return
+    logger.info("Migrating users.currencies into the user_coins table")
+    c.execute("ALTER TABLE users RENAME TO users_legacy")
+    _create_schema(c)
+    has_utc_minute = "utc_minute" in columns
+    has_active = "active" in columns
+    c.execute(f'''
+        INSERT INTO users (user_id, notification_time, timezone, utc_minute, active)
+        SELECT user_id, notification_time, timezone,
+               {"utc_minute" if has_utc_minute else "NULL"},
+               {"active" if has_active else "1"}
+        FROM users_legacy
+    ''')
+    rows = c.execute("SELECT user_id, currencies FROM users_legacy").fetchall()
+    c.executemany(
+        "INSERT OR IGNORE INTO user_coins (user_id, coin, position) VALUES (?, ?, ?)",
+        [
+            (user_id, coin, position)
+            for user_id, currencies in rows
+            for position, coin in enumerate(currencies.split(",") if currencies else [])
+            if coin
+        ]
+    )
+    c.execute("DROP TABLE users_legacy")
+
+def init_db():
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        c.execute("BEGIN")
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _migrate_legacy_users(c)
+        _create_schema(c)
+        if version < 2:
+            # Alert rules are new in version 2; keep existing users on the old global alert
+            c.execute('''
+                INSERT INTO alert_rules (user_id, coin, kind, threshold, period)
+                SELECT user_id, ?, ?, ?, ? FROM users
+            ''', DEFAULT_ALERT_RULE)
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    refresh_utc_minutes()
+    load_subscriber_index()
+
+_TRACKED_COINS_SQL = '''
+    SELECT uc.user_id, uc.coin FROM user_coins uc JOIN users u ON u.user_id = uc.user_id
+    WHERE u.active = 1{users}
+    UNION
+    SELECT r.user_id, r.coin FROM alert_rules r JOIN users u ON u.user_id = r.user_id
+    WHERE u.active = 1 AND r.coin IS NOT NULL{rules}
+'''
+
+def load_subscriber_index():
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(_TRACKED_COINS_SQL.format(users="", rules="")).fetchall()
+    subscriber_index.build(rows)
+
+def _index_users(conn, user_ids):
+    # Re-reads the coins of just these users: their list plus coins named by their alert rules
+    ids = json.dumps([str(user_id) for user_id in user_ids])
+    rows = conn.execute(_TRACKED_COINS_SQL.format(
+        users=" AND uc.user_id IN (SELECT value FROM json_each(:ids))",
+        rules=" AND r.user_id IN (SELECT value FROM json_each(:ids))",
+    ), {"ids": ids}).fetchall()
+    coins = {}
+    for user_id, coin in rows:
+        coins.setdefault(user_id, []).append(coin)
+    for user_id in json.loads(ids):
+        if user_id in coins:
+            subscriber_index.set_user(user_id, coins[user_id])
+        else:
+            subscriber_index.remove_user(user_id)
+
+def utc_offset_minutes(tz_name, now=None):
+    now = now or datetime.now(pytz.utc)
+    offset = now.astimezone(pytz.timezone(tz_name)).utcoffset()
+    return int(offset.total_seconds() // 60)
+
+def utc_minute(time_str, tz_name, now=None):
+    hour, minute = map(int, time_str.split(":"))
+    return (hour * 60 + minute - utc_offset_minutes(tz_name, now)) % 1440
+
+def refresh_utc_minutes(now=None):
+    # Offsets move with DST, so the stored UTC minute is recomputed per timezone
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        timezones = [row[0] for row in c.execute("SELECT DISTINCT timezone FROM users") if row[0]]
+        for tz_name in timezones:
+            c.execute('''
+                UPDATE users SET utc_minute = (
+                    (CAST(substr(notification_time, 1, 2) AS INTEGER) * 60
+                     + CAST(substr(notification_time, 4, 2) AS INTEGER) - ?) % 1440 + 1440
+                ) % 1440
+                WHERE timezone = ?
+            ''', (utc_offset_minutes(tz_name, now), tz_name))
 
 def save_user(user_id, timezone, coins, time):
-    conn = sqlite3.connect("crypto_bot.db")
-    c = conn.cursor()
-    c.execute('''
-        INSERT OR REPLACE INTO users (user_id, notification_time, currencies, timezone)
-        VALUES (?, ?, ?, ?)
-    ''', (str(user_id), time, ','.join(coins), timezone))
-    conn.commit()
-    conn.close()
+    user_id = str(user_id)
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        is_new = c.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None
+        c.execute('''
+            INSERT INTO users (user_id, notification_time, timezone, utc_minute, active)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (user_id) DO UPDATE SET
+                notification_time = excluded.notification_time,
+                timezone = excluded.timezone,
+                utc_minute = excluded.utc_minute,
+                active = 1
+        ''', (user_id, time, timezone, utc_minute(time, timezone)))
+        c.execute("DELETE FROM user_coins WHERE user_id = ?", (user_id,))
+        c.executemany(
+            "INSERT OR IGNORE INTO user_coins (user_id, coin, position) VALUES (?, ?, ?)",
+            [(user_id, coin, position) for position, coin in enumerate(coins)]
+        )
+        if is_new:
+            c.execute(
+                "INSERT INTO alert_rules (user_id, coin, kind, threshold, period) VALUES (?, ?, ?, ?, ?)",
+                (user_id, *DEFAULT_ALERT_RULE)
+            )
+        _index_users(conn, [user_id])
+    _bump_subscriptions_version()
+
+def import_users(users):
+    """Upsert a batch of user dicts in one transaction and return how many were written.
+
+    Each dict has user_id, timezone, coins, time and optionally active and
+    alerts. A user with an "alerts" list gets exactly those rules; a new
+    user without one gets the default rule, as in save_user.
+    """
+    users = [{**user, "user_id": str(user["user_id"])} for user in users]
+    if not users:
+        return 0
+    # Offsets are looked up once per timezone rather than once per user
+    offsets = {}
+    def user_utc_minute(user):
+        tz_name = user["timezone"]
+        if tz_name not in offsets:
+            offsets[tz_name] = utc_offset_minutes(tz_name)
+        hour, minute = map(int, user["time"].split(":"))
+        return (hour * 60 + minute - offsets[tz_name]) % 1440
+
+    ids = json.dumps([user["user_id"] for user in users])
+    with_alerts = [user for user in users if user.get("alerts") is not None]
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        existing = {row[0] for row in c.execute(
+            "SELECT user_id FROM users WHERE user_id IN (SELECT value FROM json_each(?))", (ids,)
+        )}
+        c.executemany('''
+            INSERT INTO users (user_id, notification_time, timezone, utc_minute, active)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                notification_time = excluded.notification_time,
+                timezone = excluded.timezone,
+                utc_minute = excluded.utc_minute,
+                active = excluded.active
+        ''', [
+            (user["user_id"], user["time"], user["timezone"], user_utc_minute(user), int(user.get("active", True)))
+            for user in users
+        ])
+        c.execute("DELETE FROM user_coins WHERE user_id IN (SELECT value FROM json_each(?))", (ids,))
+        c.executemany(
+            "INSERT OR IGNORE INTO user_coins (user_id, coin, position) VALUES (?, ?, ?)",
+            [(user["user_id"], coin, position) for user in users for position, coin in enumerate(user["coins"])]
+        )
+        if with_alerts:
+            alert_ids = json.dumps([user["user_id"] for user in with_alerts])
+            c.execute('''
+                DELETE FROM alert_state WHERE rule_id IN (
+                    SELECT rule_id FROM alert_rules WHERE user_id IN (SELECT value FROM json_each(?))
+                )
+            ''', (alert_ids,))
+            c.execute("DELETE FROM alert_rules WHERE user_id IN (SELECT value FROM json_each(?))", (alert_ids,))
+        c.executemany(
+            "INSERT INTO alert_rules (user_id, coin, kind, threshold, period) VALUES (?, ?, ?, ?, ?)",
+            [
+                (user["user_id"], rule["coin"], rule["kind"], rule["threshold"], rule.get("period", "24h"))
+                for user in with_alerts for rule in user["alerts"]
+            ] + [
+                (user["user_id"], *DEFAULT_ALERT_RULE)
+                for user in users if user.get("alerts") is None and user["user_id"] not in existing
+            ]
+        )
+        _index_users(conn, [user["user_id"] for user in users])
+    _bump_subscriptions_version()
+    return len(users)
+
+def export_users_page(after="", limit=1000):
+    """Return up to `limit` users with ids after `after`, including their alert rules."""
+    users = _query_users(
+        "WHERE u.user_id IN (SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?)",
+        (str(after), limit)
+    )
+    if not users:
+        return []
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute('''
+            SELECT user_id, coin, kind, threshold, period FROM alert_rules
+            WHERE user_id IN (SELECT value FROM json_each(?)) ORDER BY rule_id
+        ''', (json.dumps([user["user_id"] for user in users]),)).fetchall()
+    alerts = {}
+    for user_id, coin, kind, threshold, period in rows:
+        alerts.setdefault(user_id, []).append({"coin": coin, "kind": kind, "threshold": threshold, "period": period})
+    for user in users:
+        user["alerts"] = alerts.get(user["user_id"], [])
+    return users
+
+def get_meta(key):
+    conn = get_connection()
+    with _lock:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_meta(key, value):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+_USER_COLUMNS = "u.user_id, u.notification_time, u.timezone, u.active, uc.coin"
+
+def _rows_to_users(rows):
+    # Rows are ordered by user and coin position, one row per held coin
+    users = {}
+    for user_id, time, timezone, active, coin in rows:
+        user = users.get(user_id)
+        if user is None:
+            user = users[user_id] = {
+                "user_id": user_id,
+                "timezone": timezone,
+                "coins": [],
+                "time": time,
+                "active": bool(active)
+            }
+        if coin is not None:
+            user["coins"].append(coin)
+    return list(users.values())
+
+def _query_users(where="", params=()):
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(f'''
+            SELECT {_USER_COLUMNS}
+            FROM users u LEFT JOIN user_coins uc ON uc.user_id = u.user_id
+            {where}
+            ORDER BY u.user_id, uc.position
+        ''', params).fetchall()
+    return _rows_to_users(rows)
 
 def get_user(user_id):
-    conn = sqlite3.connect("crypto_bot.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE user_id = ?", (str(user_id),))
-    user = c.fetchone()
-    conn.close()
-    if user:
-        return {
-            "user_id": user[0],
-            "timezone": user[3],
-            "coins": user[2].split(",") if user[2] else [],
-            "time": user[1]
-        }
-    return None
-
-def get_all_users():
-    conn = sqlite3.connect("crypto_bot.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM users")
-    users = c.fetchall()
-    conn.close()
+    users = _query_users("WHERE u.user_id = ?", (str(user_id),))
+    return users[0] if users else None
+
+def get_users_by_utc_minute(minute):
+    return _query_users("WHERE u.utc_minute = ? AND u.active = 1", (minute,))
+
+def get_tracked_coins():
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(
+            f"SELECT DISTINCT coin FROM ({_TRACKED_COINS_SQL.format(users='', rules='')})"
+        ).fetchall()
+    return [row[0] for row in rows]
+
+def set_user_active(user_id, active):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute("UPDATE users SET active = ? WHERE user_id = ?", (1 if active else 0, str(user_id)))
+        _index_users(conn, [user_id])
+    _bump_subscriptions_version()
+
+def remove_user(user_id):
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM user_coins WHERE user_id = ?", (str(user_id),))
+        c.execute("DELETE FROM alert_state WHERE rule_id IN (SELECT rule_id FROM alert_rules WHERE user_id = ?)", (str(user_id),))
+        c.execute("DELETE FROM alert_rules WHERE user_id = ?", (str(user_id),))
+        c.execute("DELETE FROM deliveries WHERE user_id = ?", (str(user_id),))
+        c.execute("DELETE FROM users WHERE user_id = ?", (str(user_id),))
+        removed = c.rowcount > 0
+        _index_users(conn, [user_id])
+    _bump_subscriptions_version()
+    return removed
+
+def add_alert_rule(user_id, coin, kind, threshold, period):
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO alert_rules (user_id, coin, kind, threshold, period) VALUES (?, ?, ?, ?, ?)",
+            (str(user_id), coin, kind, threshold, period)
+        )
+        rule_id = c.lastrowid
+        _index_users(conn, [user_id])
+    _bump_subscriptions_version()
+    return rule_id
+
+def get_alert_rules(user_id):
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(
+            "SELECT rule_id, coin, kind, threshold, period FROM alert_rules WHERE user_id = ? ORDER BY rule_id",
+            (str(user_id),)
+        ).fetchall()
     return [
-        {
-            "user_id": user[0],
-            "timezone": user[3],
-            "coins": user[2].split(",") if user[2] else [],
-            "time": user[1]
-        } for user in users
+        {"rule_id": row[0], "coin": row[1], "kind": row[2], "threshold": row[3], "period": row[4]}
+        for row in rows
     ]
 
-def remove_user(user_id):
-    conn = sqlite3.connect("crypto_bot.db")
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE user_id = ?", (str(user_id),))
-    conn.commit()
-    affected_rows = c.rowcount
-    conn.close()
-    return affected_rows > 0
\ No newline at end of file
+def remove_alert_rule(user_id, rule_id):
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM alert_rules WHERE user_id = ? AND rule_id = ?", (str(user_id), rule_id))
+        removed = c.rowcount > 0
+        if removed:
+            c.execute("DELETE FROM alert_state WHERE rule_id = ?", (rule_id,))
+            _index_users(conn, [user_id])
+    _bump_subscriptions_version()
+    return removed
+
+def get_alert_targets():
+    # Rules without a coin apply to every coin in the user's list
+    conn = get_connection()
+    with _lock:
+        return conn.execute('''
+            SELECT r.rule_id, r.user_id, COALESCE(r.coin, uc.coin), r.kind, r.threshold, r.period
+            FROM alert_rules r
+            JOIN users u ON u.user_id = r.user_id AND u.active = 1
+            LEFT JOIN user_coins uc ON r.coin IS NULL AND uc.user_id = r.user_id
+            WHERE COALESCE(r.coin, uc.coin) IS NOT NULL
+        ''').fetchall()
+
+def get_alert_state():
+    # Only targets that fired and haven't re-armed are stored; anything else is armed
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute("SELECT rule_id, coin FROM alert_state").fetchall()
+    return {(rule_id, coin): False for rule_id, coin in rows}
+
+def save_alert_state(changes, fired_at):
+    # changes: (rule_id, coin, armed) for targets whose armed flag flipped this tick.
+    # Rules deleted since the tick was evaluated are skipped rather than failing the batch.
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        c.executemany(
+            """INSERT OR REPLACE INTO alert_state (rule_id, coin, fired_at)
+               SELECT ?1, ?2, ?3 WHERE EXISTS (SELECT 1 FROM alert_rules WHERE rule_id = ?1)""",
+            [(rule_id, coin, fired_at) for rule_id, coin, armed in changes if not armed]
+        )
+        c.executemany(
+            "DELETE FROM alert_state WHERE rule_id = ? AND coin = ?",
+            [(rule_id, coin) for rule_id, coin, armed in changes if armed]
+        )
+
+def mark_delivered(user_ids, kind, delivered_at):
+    # Users removed while the batch was sending are skipped rather than failing the batch
+    conn = get_connection()
+    with _lock, conn:
+        conn.executemany(
+            """INSERT OR REPLACE INTO deliveries (user_id, kind, delivered_at)
+               SELECT ?1, ?2, ?3 WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?1)""",
+            [(str(user_id), kind, delivered_at) for user_id in user_ids]
+        )
+
+def get_undelivered_users(minute, kind, due_at):
+    # Active users due at this UTC minute with no delivery recorded since due_at
+    return _query_users('''
+        LEFT JOIN deliveries d ON d.user_id = u.user_id AND d.kind = ?
+        WHERE u.utc_minute = ? AND u.active = 1 AND (d.delivered_at IS NULL OR d.delivered_at < ?)
+    ''', (kind, minute, due_at))
+
+def save_coins(coins):
+    conn = get_connection()
+    with _lock, conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM coins")
+        c.executemany(
+            "INSERT OR REPLACE INTO coins (coin_id, symbol, name, rank) VALUES (?, ?, ?, ?)",
+            [(coin['id'], coin['symbol'], coin['name'], rank) for rank, coin in enumerate(coins)]
+        )
+
+def get_coins():
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute("SELECT coin_id, symbol, name FROM coins ORDER BY rank").fetchall()
+    return [{"id": row[0], "symbol": row[1], "name": row[2]} for row in rows]
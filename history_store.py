@@ -0,0 +1,210 @@
+import logging
+import os
+import re
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", "price_history")
+# (name, seconds per slot, slots): a week of minutes, then a year of hourly closes
+TIERS = (("minute", 60, 7 * 24 * 60), ("hour", 3600, 365 * 24))
+# Longest period any tier can answer
+MAX_PERIOD = max(resolution * slots for _, resolution, slots in TIERS)
+# Rows reserved per tier file when it is created; only rows that get written take disk space
+MAX_COINS = int(os.getenv("HISTORY_MAX_COINS", "2048"))
+
+_RECORD = np.dtype([("t", "<i8"), ("usd", "<f8")])
+_PERIOD = re.compile(r"^(\d+)([mhd])$")
+_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def parse_period(text):
+    """Return a period such as "15m", "24h" or "7d" in seconds, or None.
+
+    Periods longer than the history keeps are rejected.
+    """
+    match = _PERIOD.match(text.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        return None
+    seconds = int(match.group(1)) * _UNITS[match.group(2)]
+    return seconds if seconds <= MAX_PERIOD else None
+
+
+class HistoryStore:
+    """Price history in fixed-size memory-mapped ring buffers, one file per tier.
+
+    Each tier file holds a row per coin and a slot per bucket. A sample goes
+    into slot bucket % slots together with its bucket number, and a slot only
+    counts while that number matches, so old data ages out by being
+    overwritten and the files never grow. Rows are handed out in the order
+    coins first appear in coins.txt, which is only ever appended to, so
+    several processes sharing the directory agree on them. Range queries
+    index straight into the mapped arrays.
+    """
+
+    def __init__(self, directory=HISTORY_DIR, tiers=TIERS, max_coins=MAX_COINS):
+        self.directory = directory
+        self.tiers = tiers
+        self.max_coins = max_coins
+        self._maps = {}
+        self._rows = {}
+        self._coins_read = 0
+        self._full_logged = False
+
+    def _coins_path(self):
+        return os.path.join(self.directory, "coins.txt")
+
+    def _load_rows(self):
+        try:
+            with open(self._coins_path(), "rb") as f:
+                f.seek(self._coins_read)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line still being written by another process is picked up next time
+        data = data[:data.rfind(b"\n") + 1]
+        self._coins_read += len(data)
+        for coin in data.decode().splitlines():
+            self._rows.setdefault(coin, len(self._rows))
+
+    def _row(self, coin, create=False):
+        if coin not in self._rows:
+            self._load_rows()
+        if coin not in self._rows and create and "\n" not in coin:
+            os.makedirs(self.directory, exist_ok=True)
+            # O_APPEND keeps concurrent appends whole; if two processes add the same
+            # coin, both re-read the file and settle on its first line
+            fd = os.open(self._coins_path(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, (coin + "\n").encode())
+            finally:
+                os.close(fd)
+            self._load_rows()
+        return self._rows.get(coin)
+
+    def _series(self, tier, slots, create=False):
+        series = self._maps.get(tier)
+        if series is not None:
+            return series
+        path = os.path.join(self.directory, tier + ".bin")
+        if not os.path.exists(path):
+            if not create:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            # Sized under a private name and linked into place, so nobody maps a short file
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.truncate(self.max_coins * slots * _RECORD.itemsize)
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        # Zero-filled slots read as bucket 0, which no query ever asks for
+        rows = os.path.getsize(path) // (slots * _RECORD.itemsize)
+        series = np.memmap(path, dtype=_RECORD, mode="r+", shape=(rows, slots))
+        self._maps[tier] = series
+        return series
+
+    def record(self, quotes, now=None):
+        """Append the latest price of each coin in a {coin: {"usd": ...}} snapshot."""
+        now = time.time() if now is None else now
+        rows, prices = [], []
+        for coin, data in quotes.items():
+            usd = data.get("usd") if data else None
+            if usd is None:
+                continue
+            row = self._row(coin, create=True)
+            if row is None:
+                continue
+            rows.append(row)
+            prices.append(usd)
+        if not rows:
+            return
+        rows = np.array(rows)
+        for tier, resolution, slots in self.tiers:
+            bucket = int(now // resolution)
+            series = self._series(tier, slots, create=True)
+            fits = rows < len(series)
+            if not fits.all() and not self._full_logged:
+                logger.warning(f"Price history is full at {len(series)} coins; raise HISTORY_MAX_COINS to record more")
+                self._full_logged = True
+            series["t"][rows[fits], bucket % slots] = bucket
+            series["usd"][rows[fits], bucket % slots] = np.asarray(prices)[fits]
+
+    def _tier_for(self, start, now):
+        for tier, resolution, slots in self.tiers:
+            if now - start <= resolution * slots:
+                return tier, resolution, slots
+        return self.tiers[-1]
+
+    def range(self, coin, start, end=None, now=None):
+        """Return (timestamps, prices) for coin between start and end.
+
+        Uses the finest tier whose retention still covers start.
+        """
+        now = time.time() if now is None else now
+        end = now if end is None else end
+        tier, resolution, slots = self._tier_for(start, now)
+        # Nothing older than the tier's retention survives, so don't build buckets for it
+        start = max(start, now - resolution * slots)
+        end = min(end, now)
+        row = self._row(coin)
+        series = self._series(tier, slots)
+        if row is None or series is None or row >= len(series) or end < start:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        buckets = np.arange(int(start // resolution), int(end // resolution) + 1, dtype=np.int64)[-slots:]
+        rows = series[row, buckets % slots]
+        valid = rows["t"] == buckets
+        return buckets[valid] * resolution, rows["usd"][valid]
+
+    def price_at(self, coin, when, tolerance=300, now=None):
+        """Latest price recorded at or before `when`, at most `tolerance` seconds earlier."""
+        _, prices = self.range(coin, when - tolerance, when, now=now)
+        return float(prices[-1]) if len(prices) else None
+
+    def change(self, coin, seconds, current, now=None):
+        now = time.time() if now is None else now
+        past = self.price_at(coin, now - seconds, tolerance=max(seconds // 5, 120), now=now)
+        if not past:
+            return None
+        return (current / past - 1) * 100
+
+    def enrich(self, snapshot, windows, now=None):
+        """Copy snapshot adding change_<window> fields computed from history."""
+        now = time.time() if now is None else now
+        result = {}
+        for coin, data in snapshot.items():
+            extra = {}
+            if data and data.get("usd") is not None:
+                for window, seconds in windows.items():
+                    extra[f"change_{window}"] = self.change(coin, seconds, data["usd"], now)
+            result[coin] = {**data, **extra} if extra else data
+        return result
+
+    def flush(self):
+        for series in self._maps.values():
+            series.flush()
+
+    def close(self):
+        self.flush()
+        self._maps.clear()
+
+
+def sparkline(values, width=30):
+    """Render values as a one-line block chart of at most `width` characters."""
+    blocks = "▁▂▃▄▅▆▇█"
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return ""
+    if len(values) > width:
+        # Downsample to the last value of each of `width` equal slices
+        edges = np.linspace(0, len(values), width + 1).astype(int)
+        values = values[edges[1:] - 1]
+    low, high = values.min(), values.max()
+    if high == low:
+        return blocks[3] * len(values)
+    levels = ((values - low) / (high - low) * (len(blocks) - 1)).round().astype(int)
+    return "".join(blocks[level] for level in levels)
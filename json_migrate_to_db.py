@@ -1,23 +1,180 @@
+import argparse
 import json
 import logging
-from db import save_user
+import os
+import time
+from db import export_users_page, get_meta, import_users, init_db, set_meta
 
 # Configure logging to match remainder_bot.py
 logger = logging.getLogger(__name__)
 
+DEFAULT_TIMEZONE = "Asia/Shanghai"
+DEFAULT_COINS = ["bitcoin", "ethereum", "dogecoin"]
+DEFAULT_TIME = "08:00"
+BATCH_SIZE = 1000
+READ_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+
+def _iter_object_items(f):
+    """Yield (key, value) pairs of a top-level JSON object without loading it whole."""
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = f.read(READ_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+        return not eof
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or not fill():
+                return
+
+    def expect(*chars):
+        nonlocal position
+        skip_whitespace()
+        if position >= len(buffer) or buffer[position] not in chars:
+            raise ValueError(f"Expected one of {chars} in JSON object")
+        position += 1
+        return buffer[position - 1]
+
+    def decode():
+        nonlocal position
+        skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # A number cut off at the buffer edge parses but isn't complete yet
+            if end == len(buffer) and not eof:
+                fill()
+                continue
+            position = end
+            return value
+
+    expect("{")
+    skip_whitespace()
+    if position < len(buffer) and buffer[position] == "}":
+        return
+    while True:
+        key = decode()
+        expect(":")
+        yield key, decode()
+        if expect(",", "}") == "}":
+            return
+
+
+def iter_users(path):
+    """Yield user dicts from a legacy subscribers.json object or a JSON-lines export."""
+    with open(path, "r") as f:
+        # Exports write user_id first on every line; legacy files are keyed by user id
+        json_lines = f.read(64).lstrip().startswith('{"user_id"')
+        f.seek(0)
+        if json_lines:
+            for line in f:
+                if line.strip():
+                    yield _normalize(json.loads(line))
+        else:
+            for user_id, config in _iter_object_items(f):
+                yield _normalize({**config, "user_id": user_id})
+
+
+def _normalize(user):
+    return {
+        "user_id": str(user["user_id"]),
+        "timezone": user.get("timezone") or DEFAULT_TIMEZONE,
+        "coins": user.get("coins") or DEFAULT_COINS,
+        "time": user.get("time") or DEFAULT_TIME,
+        "active": user.get("active", True),
+        "alerts": user.get("alerts"),
+    }
+
+
+def import_from_file(path, batch_size=BATCH_SIZE):
+    """Stream users from path into the database in batched transactions."""
+    started = time.perf_counter()
+    count = 0
+    batch = []
+    for user in iter_users(path):
+        batch.append(user)
+        if len(batch) >= batch_size:
+            count += import_users(batch)
+            batch = []
+    if batch:
+        count += import_users(batch)
+    logger.info(f"Imported {count} users from {path} in {time.perf_counter() - started:.1f}s")
+    return count
+
+
+def export_to_file(path, batch_size=BATCH_SIZE):
+    """Write every user, with coins and alert rules, as one JSON object per line."""
+    count = 0
+    after = ""
+    with open(path, "w") as f:
+        while True:
+            users = export_users_page(after, batch_size)
+            if not users:
+                break
+            for user in users:
+                f.write(json.dumps(user) + "\n")
+            count += len(users)
+            after = users[-1]["user_id"]
+    logger.info(f"Exported {count} users to {path}")
+    return count
+
+
 def migrate_from_json(json_file="subscribers.json"):
+    # The marker records a finished import so later startups don't re-read the file
+    marker = f"json_migrated:{os.path.abspath(json_file)}"
+    if get_meta(marker):
+        return
     try:
-        with open(json_file, "r") as f:
-            data = json.load(f)
-        for user, config in data.items():
-            save_user(
-                user,
-                config.get("timezone", "Asia/Shanghai"),
-                config.get("coins", ["bitcoin", "ethereum", "dogecoin"]),
-                config.get("time", "08:00")
-            )
+        count = import_from_file(json_file)
+        set_meta(marker, json.dumps({"users": count, "at": time.strftime("%Y-%m-%d %H:%M:%S")}))
         logger.info(f"Migration from {json_file} to SQLite completed successfully")
     except FileNotFoundError:
         logger.info(f"No JSON file found at {json_file}, skipping migration")
     except Exception as e:
-        logger.error(f"Error during migration from {json_file}: {e}")
\ No newline at end of file
+        logger.error(f"Error during migration from {json_file}: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move subscribers between JSON files and the bot database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="one-shot import of a legacy subscribers.json")
+    migrate.add_argument("path", nargs="?", default="subscribers.json")
+    migrate.add_argument("--force", action="store_true", help="import again even if already migrated")
+    export = commands.add_parser("export", help="write all users to a JSON-lines file")
+    export.add_argument("path")
+    load = commands.add_parser("import", help="upsert users from a JSON-lines export or legacy file")
+    load.add_argument("path")
+    for command in (export, load):
+        command.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    init_db()
+    if args.command == "migrate":
+        if args.force:
+            set_meta(f"json_migrated:{os.path.abspath(args.path)}", "")
+        migrate_from_json(args.path)
+    elif args.command == "export":
+        export_to_file(args.path, args.batch_size)
+    else:
+        import_from_file(args.path, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
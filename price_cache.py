@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class PriceCache:
+    """Process-wide TTL cache of per-coin quotes with request coalescing."""
+
+    def __init__(self, ttl=60, max_size=5000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    def get(self, coin):
+        entry = self._entries.get(coin)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self._entries[coin]
+            return None
+        self._entries.move_to_end(coin)
+        return data
+
+    def set(self, coin, data):
+        self._entries[coin] = (time.monotonic() + self.ttl, data)
+        self._entries.move_to_end(coin)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_many(self, coin_ids, fetch):
+        """Return cached quotes for coin_ids, fetching misses with fetch(ids).
+
+        Coins already being fetched by another caller are awaited rather than
+        requested again, so concurrent misses share one upstream call.
+        """
+        result = {}
+        missing = []
+        waiting = {}
+        for coin in coin_ids:
+            data = self.get(coin)
+            if data is not None:
+                self.hits += 1
+                result[coin] = data
+                continue
+            self.misses += 1
+            if coin in self._inflight:
+                waiting[coin] = self._inflight[coin]
+            else:
+                missing.append(coin)
+
+        if missing:
+            future = asyncio.get_running_loop().create_future()
+            for coin in missing:
+                self._inflight[coin] = future
+            try:
+                fetched = await fetch(missing)
+            except BaseException:
+                if not future.done():
+                    future.set_result({})
+                raise
+            else:
+                for coin, data in fetched.items():
+                    self.set(coin, data)
+                if not future.done():
+                    future.set_result(fetched)
+            finally:
+                for coin in missing:
+                    if self._inflight.get(coin) is future:
+                        del self._inflight[coin]
+            for coin in missing:
+                if coin in fetched:
+                    result[coin] = fetched[coin]
+
+        for coin, future in waiting.items():
+            data = (await asyncio.shield(future)).get(coin)
+            if data is not None:
+                result[coin] = data
+        return result
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import time
+import aiohttp
+from crypto_utils import from_coincap_id, market_data, price_history, price_store, to_coincap_id
+
+logger = logging.getLogger(__name__)
+
+COINCAP_WS_URL = "wss://ws.coincap.io/prices"
+_WS_CLOSED = (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED)
+
+
+class PriceSource:
+    """Base class for price sources.
+
+    stream() is an async generator yielding {coin_id: fields} updates; a
+    source may send full quotes or only the fields that changed.
+    """
+
+    async def stream(self):
+        raise NotImplementedError
+        yield
+
+
+class RestPollingSource(PriceSource):
+    """Polls CoinGecko for the coins returned by coins_provider()."""
+
+    def __init__(self, coins_provider, interval=60, client=market_data):
+        self.coins_provider = coins_provider
+        self.interval = interval
+        self.client = client
+
+    async def stream(self):
+        while True:
+            coins = self.coins_provider()
+            if coins:
+                snapshot, failures = await self.client.get_prices_bulk(coins)
+                if failures:
+                    logger.warning(f"Price poll missed {sum(len(f['ids']) for f in failures)} coins")
+                yield snapshot
+            await asyncio.sleep(self.interval)
+
+
+class WebSocketSource(PriceSource):
+    """Streams live prices from CoinCap's websocket feed.
+
+    CoinCap only pushes prices, so each connection is seeded with a full
+    REST snapshot and re-seeded every `reseed_interval` seconds while it
+    stays open, keeping market cap and 24h change current. The connection
+    is re-opened when the tracked coin set changes. Ids are translated
+    through COINCAP_IDS; a coin CoinCap names differently and that isn't
+    listed there never streams and only refreshes with the REST snapshots.
+    """
+
+    def __init__(self, coins_provider, url=COINCAP_WS_URL, client=market_data, resubscribe_interval=60,
+                 reseed_interval=60):
+        self.coins_provider = coins_provider
+        self.url = url
+        self.client = client
+        self.resubscribe_interval = resubscribe_interval
+        self.reseed_interval = reseed_interval
+
+    async def stream(self):
+        async with aiohttp.ClientSession() as session:
+            while True:
+                coins = sorted(self.coins_provider())
+                if not coins:
+                    await asyncio.sleep(self.resubscribe_interval)
+                    continue
+                snapshot, _ = await self.client.get_prices_bulk(coins)
+                yield snapshot
+
+                seeded_at = checked_at = time.monotonic()
+                resubscribe = False
+                assets = ",".join(to_coincap_id(coin) for coin in coins)
+                async with session.ws_connect(self.url, params={"assets": assets}, heartbeat=30) as ws:
+                    while True:
+                        # Wake up for the next re-seed even when the feed is quiet
+                        wait = max(0.0, seeded_at + self.reseed_interval - time.monotonic())
+                        try:
+                            message = await ws.receive(timeout=wait)
+                        except asyncio.TimeoutError:
+                            message = None
+                        if message is not None:
+                            if message.type in _WS_CLOSED:
+                                break
+                            if message.type == aiohttp.WSMsgType.ERROR:
+                                raise ws.exception()
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                yield {
+                                    from_coincap_id(asset): {'usd': float(price)}
+                                    for asset, price in json.loads(message.data).items()
+                                }
+                        if time.monotonic() - seeded_at >= self.reseed_interval:
+                            snapshot, _ = await self.client.get_prices_bulk(coins)
+                            seeded_at = time.monotonic()
+                            yield snapshot
+                        if time.monotonic() - checked_at > self.resubscribe_interval:
+                            checked_at = time.monotonic()
+                            if sorted(self.coins_provider()) != coins:
+                                resubscribe = True
+                                break
+                if not resubscribe:
+                    raise ConnectionError("Price websocket closed")
+
+
+class ReplaySource(PriceSource):
+    """Replays recorded snapshots, e.g. from a JSON-lines file, for offline runs."""
+
+    def __init__(self, snapshots, interval=0.0):
+        self.snapshots = snapshots
+        self.interval = interval
+
+    def _iter_snapshots(self):
+        if isinstance(self.snapshots, str):
+            with open(self.snapshots) as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            yield from self.snapshots
+
+    async def stream(self):
+        for snapshot in self._iter_snapshots():
+            yield snapshot
+            await asyncio.sleep(self.interval)
+
+
+def create_source(mode, coins_provider, interval=60):
+    if mode == "rest":
+        return RestPollingSource(coins_provider, interval=interval)
+    if mode == "websocket":
+        return WebSocketSource(coins_provider, reseed_interval=interval)
+    if mode.startswith("replay:"):
+        return ReplaySource(mode[len("replay:"):], interval=interval)
+    raise ValueError(f"Unknown price feed mode: {mode}")
+
+
+class PriceFeed:
+    """Runs a PriceSource in the background and writes into a PriceStore."""
+
+    def __init__(self, source, store=price_store, history=price_history, max_backoff=60):
+        self.source = source
+        self.store = store
+        self.history = history
+        self.max_backoff = max_backoff
+        self.updates = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        backoff = 1
+        while True:
+            try:
+                async for quotes in self.source.stream():
+                    # Last-good quotes served during an outage must not look fresh to the store
+                    quotes = {coin: data for coin, data in quotes.items() if not data.get('stale')}
+                    self.store.update(quotes)
+                    if self.history is not None:
+                        self.history.record(quotes)
+                    self.updates += 1
+                    backoff = 1
+                logger.info("Price source finished")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Price feed error, reconnecting in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,48 @@
+import time
+
+REQUIRED_FIELDS = ('usd', 'market_cap', 'change_24h')
+
+
+class PriceStore:
+    """Latest quote per coin as pushed by a price feed.
+
+    Reads never touch the network; entries older than max_age are treated
+    as missing so callers fall back to fetching them.
+    """
+
+    def __init__(self, max_age=120):
+        self.max_age = max_age
+        self._quotes = {}
+
+    def __len__(self):
+        return len(self._quotes)
+
+    def update(self, quotes):
+        now = time.monotonic()
+        for coin, data in quotes.items():
+            entry = self._quotes.get(coin)
+            # Streaming sources may only send some fields, e.g. the latest price
+            if entry:
+                self._quotes[coin] = (now, {**entry[1], **data})
+            elif all(field in data for field in REQUIRED_FIELDS):
+                self._quotes[coin] = (now, dict(data))
+
+    def get(self, coin):
+        entry = self._quotes.get(coin)
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            return None
+        return entry[1]
+
+    def get_many(self, coin_ids):
+        found = {}
+        missing = []
+        for coin in coin_ids:
+            data = self.get(coin)
+            if data is None:
+                missing.append(coin)
+            else:
+                found[coin] = data
+        return found, missing
+
+    def snapshot(self):
+        return {coin: data for coin, (_, data) in self._quotes.items()}
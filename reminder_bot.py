@@ -1,35 +1,114 @@
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from crypto_utils import get_price, get_top_coins
-from datetime import time as dtime
-import pytz
+from crypto_utils import get_price, market_data, price_history
+from coin_registry import coin_registry, REFRESH_INTERVAL
+from datetime import datetime, timedelta, timezone
+import asyncio
+import atexit
 import logging
+import queue
+import os
+import signal
+import sqlite3
+import time
 import re
-from db import get_user, get_all_users, save_user, remove_user, init_db
+from logging.handlers import QueueHandler, QueueListener
+from db import (
+    get_user, get_users_by_utc_minute, save_user, remove_user, set_user_active,
+    add_alert_rule, get_alert_rules, remove_alert_rule, get_alert_targets, subscriptions_version,
+    get_alert_state, save_alert_state, mark_delivered, get_undelivered_users,
+    init_db, refresh_utc_minutes, run_db, close_db, subscriber_index
+)
 from json_migrate_to_db import migrate_from_json
-
-# Configure logging
+from broadcast import GLOBAL_RATE, Broadcaster
+from price_feed import PriceFeed, create_source
+from alert_engine import AlertEngine, KINDS, PERIOD_FIELDS, WINDOW_PERIODS
+from history_store import MAX_PERIOD, parse_period, sparkline
+from sharding import shard_for
+from webhook import ChatOrderedDispatcher, WebhookServer, webhook_secret
+from render import morning_message, price_message
+from metrics import EventLoopMonitor, MetricsServer, SamplingProfiler, registry
+import numpy as np
+
+# Configure logging: handlers write from a listener thread so logging never blocks the event loop
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.FileHandler("crypto_reminder_bot.log"), logging.StreamHandler())
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO,
-    handlers=[
-        logging.FileHandler("crypto_reminder_bot.log"),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(_log_queue)]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
+DEFAULT_TIMEZONE = "Asia/Shanghai"
+DEFAULT_COINS = ["bitcoin", "ethereum", "dogecoin"]
+DEFAULT_TIME = "08:00"
+
+# Optional background price feed: "rest", "websocket" or "replay:<file.jsonl>"
+PRICE_FEED = os.getenv("PRICE_FEED", "")
+PRICE_FEED_INTERVAL = float(os.getenv("PRICE_FEED_INTERVAL", "60"))
+
+# Reminders due this many minutes before startup are still sent
+REMINDER_CATCHUP_MINUTES = int(os.getenv("REMINDER_CATCHUP_MINUTES", "60"))
+REMINDER_BATCH_SIZE = 1000
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Point the bot at a different Bot API server, e.g. a local fake for testing
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "")
+
+# Webhook mode is used when WEBHOOK_PORT is set; WEBHOOK_URL is registered with Telegram if given.
+# Without WEBHOOK_SECRET a random one is registered with WEBHOOK_URL; with neither, webhook mode won't start
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "0"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "32"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+
+# Prometheus-style metrics on METRICS_LISTEN:METRICS_PORT/metrics when the port is set
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# Optional sampling profiler writing collapsed stacks to this file on shutdown
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+
+# How often tracked coins are sampled into the price history when no price feed runs
+HISTORY_INTERVAL = int(os.getenv("HISTORY_INTERVAL", "60"))
+ALERT_PERIODS = "|".join(PERIOD_FIELDS)
+
 
 class CryptoReminderBot:
-    def __init__(self, token):
-        self.app = (
+    def __init__(self, token, shard_index=0, shard_count=1, updater=True):
+        # In sharded mode this instance only owns chats with shard_for(chat_id) == shard_index
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        builder = (
             ApplicationBuilder()
             .token(token)
-            .post_init(self.setup_jobs)
-            .build()
+            .post_init(self.post_init)
+            .post_shutdown(self.shutdown)
         )
+        if TELEGRAM_BASE_URL:
+            builder = builder.base_url(TELEGRAM_BASE_URL)
+        if not updater:
+            builder = builder.updater(None)
+        self.app = builder.build()
         self._register_handlers()
-        self.alerted_coins = set()
+        # Telegram's global send limit is per bot token, so shards split it
+        self.broadcaster = Broadcaster(
+            self.app.bot, global_rate=GLOBAL_RATE / shard_count, on_blocked=self._deactivate_chat
+        )
+        self.alert_engine = AlertEngine()
+        self._alert_rules_version = None
+        self.price_feed = None
+        self._last_dispatched_minute = None
+        self._utc_minutes_hour = None
+        self.metrics_server = None
+        self.loop_monitor = None
+        self.profiler = None
 
     def _register_handlers(self):
         self.app.add_handler(CommandHandler("start", self.start))
@@ -42,6 +121,11 @@ class CryptoReminderBot:
         self.app.add_handler(CommandHandler("settimezone", self.change_timezone))
         self.app.add_handler(CommandHandler("setcoins", self.set_coins))
         self.app.add_handler(CommandHandler("settime", self.set_time))
+        self.app.add_handler(CommandHandler("alerts", self.alerts))
+        self.app.add_handler(CommandHandler("addalert", self.add_alert))
+        self.app.add_handler(CommandHandler("delalert", self.delete_alert))
+        self.app.add_handler(CommandHandler("history", self.history))
+        self.app.add_handler(CommandHandler("chart", self.chart))
         # Handle unknown commands
         self.app.add_handler(MessageHandler(filters.COMMAND, self.unknown_command))
 
@@ -55,30 +139,15 @@ class CryptoReminderBot:
             await update.message.reply_text("Please specify one or more coin IDs, e.g., /price bitcoin eth or type /help for help")
             return
 
-        coin_ids = [coin.lower() for coin in context.args]
-        prices = get_price(",".join(coin_ids))
-
-        for coin in coin_ids:
-            data = prices.get(coin)
-            if data:
-                change = data['change_24h']
-                if change > 0:
-                    emoji = "📈"
-                elif change < 0:
-                    emoji = "📉"
-                msg = (
-                    f"{coin.upper()}\n"
-                    f"Price: ${data['usd']:,.2f}\n"
-                    f"24h Change: {emoji} {data['change_24h']:.2f}%\n"
-                    f"Market Cap: ${data['market_cap']:,.0f}\n"
-                )
-                await update.message.reply_text(msg, parse_mode="HTML", disable_web_page_preview=False)
-            else:
-                await update.message.reply_text(f"❌ '{coin}' not found.")
+        coin_ids = [coin_registry.resolve(coin) or coin.lower() for coin in context.args]
+        prices = await get_price(",".join(coin_ids))
 
+        footer = None
         if any(prices.get(coin) is None for coin in coin_ids):
-            top_coins = get_top_coins()
-            await update.message.reply_text("📈 Top 10 Coin IDs:\n" + ", ".join(top_coins))
+            footer = "📈 Top 10 Coin IDs:\n" + ", ".join(coin_registry.top(10))
+        # One reply for all coins; Telegram's per-chat quota counts messages, not coins
+        for chunk in price_message(coin_ids, prices, footer):
+            await update.message.reply_text(chunk, parse_mode="HTML")
 
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = (
@@ -94,6 +163,12 @@ class CryptoReminderBot:
             "  <i>Example:</i> <code>/setcoins bitcoin eth dogecoin</code>\n\n"
             "🟢 <b>/settime &lt;HH:MM&gt;</b> — Set your preferred daily update time.\n"
             "  <i>Example:</i> <code>/settime 09:30</code>\n\n"
+            "🟢 <b>/alerts</b> — List your price alerts.\n"
+            f"🟢 <b>/addalert &lt;coin&gt; &lt;move|above|below&gt; &lt;value&gt; [{ALERT_PERIODS}]</b> — Add a price alert.\n"
+            "  <i>Example:</i> <code>/addalert bitcoin move 3 15m</code>\n"
+            "🟢 <b>/delalert &lt;id&gt;</b> — Remove a price alert.\n\n"
+            "🟢 <b>/history &lt;coin&gt; [1h|24h|7d|30d]</b> — Open, high, low and change over a period.\n"
+            "🟢 <b>/chart &lt;coin&gt; [1h|24h|7d|30d]</b> — A small price chart for a period.\n\n"
             "🟢 <b>/testmorning</b> — Test the morning message immediately.\n\n"
             "💡 <b>Tip:</b> Use coin IDs like <code>bitcoin</code>, <code>ethereum</code>, <code>dogecoin</code>.\n"
             "❓ If you see strange output, check your coin ID spelling.\n"
@@ -102,23 +177,20 @@ class CryptoReminderBot:
 
     async def subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = str(update.effective_chat.id)
-        user = get_user(chat_id)
-        if user:
+        user = await run_db(get_user, chat_id)
+        if user and user["active"]:
             await update.message.reply_text("📬 You're already subscribed.")
+        elif user:
+            await run_db(set_user_active, chat_id, True)
+            await update.message.reply_text("✅ You've subscribed to daily updates.")
         else:
-            save_user(chat_id, "Asia/Shanghai",["bitcoin", "ethereum", "dogecoin"], '08:00')
-            await self.setup_jobs(self.app)
+            await self._upsert_schedule(chat_id)
             await update.message.reply_text("✅ You've subscribed to daily updates.")
        
 
     async def unsubscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = str(update.effective_chat.id)
-        if remove_user(chat_id):
-            if self.app.job_queue:
-                jobs = self.app.job_queue.get_jobs_by_name(f"daily_morning_reminder_{chat_id}")
-                for job in jobs:
-                    job.schedule_removal()
-                logger.info(f"Removed job for chat {chat_id}")
+        if await run_db(remove_user, chat_id):
             await update.message.reply_text("🚫 You've unsubscribed.")
         else:
             await update.message.reply_text("❌ You weren't subscribed.")
@@ -132,65 +204,126 @@ class CryptoReminderBot:
 
         # subscribe button handler       
         if data == "subscribe":
-            user = get_user(chat_id)
-            if user:
+            user = await run_db(get_user, chat_id)
+            if user and user["active"]:
                 await query.message.reply_text("📬 You're already subscribed.")
+            elif user:
+                await run_db(set_user_active, chat_id, True)
+                await query.message.reply_text("✅ You've subscribed to daily updates.")
             else:
-                save_user(chat_id, "Asia/Shanghai", ["bitcoin", "ethereum", "dogecoin"], "08:00")
-                await self.setup_jobs(self.app)
+                await self._upsert_schedule(chat_id)
                 await query.message.reply_text("✅ You've subscribed to daily updates.")
         # unsubscribe button handler
         elif data == "unsubscribe":
-            if remove_user(chat_id):
-                if self.app.job_queue:
-                    jobs = self.app.job_queue.get_jobs_by_name(f"daily_morning_reminder_{chat_id}")
-                    for job in jobs:
-                        job.schedule_removal()
-                    logger.info(f"Removed job for chat {chat_id}")
+            if await run_db(remove_user, chat_id):
                 await query.message.reply_text("🚫 Unsubscribed via button.")
             else:
                 await query.message.reply_text("❌ You weren't subscribed.")
         elif data.startswith("tz_"):
             tz = data.replace("tz_", "")
-            user = get_user(chat_id)
+            user = await run_db(get_user, chat_id)
             if user:
-                save_user(chat_id, tz, user['coins'], user['time'])
-                if self.app.job_queue:
-                    jobs = self.app.job_queue.get_jobs_by_name(f"daily_morning_reminder_{chat_id}")
-                    for job in jobs:
-                        job.schedule_removal()
-                    hour, minute = map(int, user['time'].split(":"))
-                    tz_obj = pytz.timezone(tz)
-                    self.app.job_queue.run_daily(
-                        callback=self.morning_reminder,
-                        time=dtime(hour=hour, minute=minute, tzinfo=tz_obj),
-                        name=f"daily_morning_reminder_{chat_id}",
-                        data={"chat_id": int(chat_id)}
-                    )
-                    logger.info(f"Rescheduled reminder for chat {chat_id} in timezone {tz}")
+                await self._upsert_schedule(chat_id, tz_name=tz)
                 await query.message.reply_text(f"🌍 Timezone changed to {tz.replace('_', ' ')} for daily reminders.")
             else:
                 await query.message.reply_text("❌ You need to subscribe first to change timezone.")
 
+    async def _upsert_schedule(self, chat_id, tz_name=None, coins=None, time=None):
+        # Single write path for a chat's reminder settings; the dispatcher
+        # picks up the new UTC minute from the row, so no jobs are touched.
+        user = await run_db(get_user, chat_id)
+        if user:
+            tz_name = tz_name or user["timezone"]
+            coins = coins or user["coins"]
+            time = time or user["time"]
+        tz_name = tz_name or DEFAULT_TIMEZONE
+        coins = coins or DEFAULT_COINS
+        time = time or DEFAULT_TIME
+        await run_db(save_user, chat_id, tz_name, coins, time)
+        logger.info(f"📅 Reminder for chat {chat_id} scheduled at {time} in timezone {tz_name}")
+
     async def morning_reminder(self, context: ContextTypes.DEFAULT_TYPE):
         chat_id = str(context.job.data['chat_id'])
-        user = get_user(chat_id)
+        user = await run_db(get_user, chat_id)
         if not user:
             logger.warning(f"No configuration found for chat {chat_id}")
             return
 
-        coins = user.get('coins', ['bitcoin', 'ethereum', 'dogecoin'])
-        prices = get_price(",".join(coins))
+        coins = user.get('coins', DEFAULT_COINS)
+        prices = await get_price(coins)
+        await context.bot.send_message(chat_id=chat_id, text=self._format_morning_message(coins, prices))
 
-        lines = ["🌅 Morning Crypto Update\n"]
-        for coin in coins:
-            data = prices.get(coin)
-            if data:
-                emoji = "🔺" if data['change_24h'] >= 0 else "🔻"
-                lines.append(f"{coin.upper()}: ${data['usd']:,.2f} {emoji}{data['change_24h']:.1f}%")
+    def _format_morning_message(self, coins, prices):
+        return morning_message(coins, prices)
 
-        message = "\n".join(lines)
-        await context.bot.send_message(chat_id=chat_id, text=message)
+    async def dispatch_reminders(self, context: ContextTypes.DEFAULT_TYPE):
+        now = datetime.now(timezone.utc)
+        current = now.hour * 60 + now.minute
+        if self._last_dispatched_minute is None:
+            minutes = [current]
+        else:
+            # Catch up on minutes skipped by a late tick, but never replay more than an hour
+            elapsed = min((current - self._last_dispatched_minute) % 1440, 60)
+            minutes = [(current - offset) % 1440 for offset in reversed(range(elapsed))]
+        self._last_dispatched_minute = current
+
+        if now.hour != self._utc_minutes_hour:
+            await run_db(refresh_utc_minutes)
+            self._utc_minutes_hour = now.hour
+
+        users = []
+        for minute in minutes:
+            users.extend(await run_db(get_users_by_utc_minute, minute))
+        users = [user for user in users if self._owns(user['user_id'])]
+        if users:
+            report = await self._send_reminders(users)
+            logger.info(f"Dispatched reminders for UTC minute(s) {minutes}: {report}")
+
+    async def _send_reminders(self, users):
+        coins = set()
+        for user in users:
+            coins.update(user['coins'])
+        prices = await get_price(sorted(coins))
+
+        # Users sharing a coin list share one rendered message
+        messages = {}
+        for user in users:
+            key = tuple(user['coins'])
+            if key not in messages:
+                messages[key] = self._format_morning_message(user['coins'], prices)
+
+        delivered = []
+        report = await self.broadcaster.send_many(
+            ((user['user_id'], messages[tuple(user['coins'])]) for user in users),
+            delivered=delivered
+        )
+        await run_db(mark_delivered, delivered, "morning", datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT))
+        return report
+
+    async def catch_up_reminders(self, context: ContextTypes.DEFAULT_TYPE):
+        # Send reminders that fell due while the bot was down, oldest first. Minutes after
+        # `until` belong to the dispatcher, so a tick racing this job can't send them twice.
+        until = context.job.data["until"]
+        users = []
+        for offset in reversed(range(REMINDER_CATCHUP_MINUTES + 1)):
+            due = until - timedelta(minutes=offset)
+            users.extend(await run_db(
+                get_undelivered_users, due.hour * 60 + due.minute, "morning", due.strftime(TIMESTAMP_FORMAT)
+            ))
+        users = [user for user in users if self._owns(user['user_id'])]
+        if not users:
+            return
+        logger.info(f"Catching up on {len(users)} missed reminders")
+        for start in range(0, len(users), REMINDER_BATCH_SIZE):
+            report = await self._send_reminders(users[start:start + REMINDER_BATCH_SIZE])
+            logger.info(f"Catch-up batch delivered: {report}")
+
+    def _owns(self, chat_id):
+        return self.shard_count == 1 or shard_for(chat_id, self.shard_count) == self.shard_index
+
+    async def _deactivate_chat(self, chat_id):
+        await run_db(set_user_active, chat_id, False)
+        logger.info(f"Marked chat {chat_id} as inactive")
 
     async def test_morning(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = str(update.effective_chat.id)
@@ -219,21 +352,17 @@ class CryptoReminderBot:
             await update.message.reply_text("❌ Please specify coin IDs. Example: /setcoins bitcoin eth doge")
             return
         coins = [coin.lower() for coin in context.args]
-        valid_coins, invalid_coins = self._validate_coins(coins)
+        valid_coins, invalid_coins = await self._validate_coins(coins)
 
         if not valid_coins:
             msg = "❌ None of the provided coin IDs are valid. Please try again."
-            top_coins = get_top_coins()
+            top_coins = coin_registry.top(10)
             msg += f"\n📈 Top 10 Coin IDs: {', '.join(top_coins)}"
             await update.message.reply_text(msg)
             return
 
         try:
-            user = get_user(chat_id)
-            if not user:
-                save_user(chat_id, "Asia/Shanghai", valid_coins, "08:00")
-            else:
-                save_user(chat_id, user["timezone"], valid_coins, user["time"])
+            await self._upsert_schedule(chat_id, coins=valid_coins)
             msg = f"✅ Your daily update coins have been set to: {', '.join(valid_coins).upper()}"
             if invalid_coins:
                 msg += f"\nInvalid coins ignored: {', '.join(invalid_coins)}"
@@ -243,13 +372,23 @@ class CryptoReminderBot:
             await update.message.reply_text("❌ Failed to set coins. Please try again.")
 
 
-    def _validate_coins(self, coins):
-        valid_coins = get_top_coins(limit=1000)
+    async def _validate_coins(self, coins):
+        if not coin_registry:
+            await coin_registry.refresh()
+        if not coin_registry:
+            # No coin list from any provider yet: accept whatever can be priced right now
+            prices = await get_price([coin.lower() for coin in coins])
+            validated = list(dict.fromkeys(coin.lower() for coin in coins if coin.lower() in prices))
+            invalid = [coin for coin in coins if coin.lower() not in prices]
+            logger.warning(f"Coin registry unavailable, validated {validated} by price lookup")
+            return validated, invalid
         validated = []
         invalid = []
         for coin in coins:
-            if coin.lower() in valid_coins:
-                validated.append(coin.lower())
+            coin_id = coin_registry.resolve(coin)
+            if coin_id:
+                if coin_id not in validated:
+                    validated.append(coin_id)
             else:
                 invalid.append(coin)
         logger.info(f"User input coins: {coins}")
@@ -278,88 +417,319 @@ class CryptoReminderBot:
             await update.message.reply_text("Invalid time value. Hours should be 00-23 and minuts 00-59")
             return
         
-        user = get_user(chat_id)
-        if not user:
-            save_user(chat_id, "Asia/Shanghai", ["bitcoin"], time_input)
-        else:
-            save_user(chat_id, user["timezone"], user["coins"], time_input)
-            # Reschedule job with new time
-            if self.app.job_queue:
-                jobs = self.app.job_queue.get_jobs_by_name(f"daily_morning_reminder_{chat_id}")
-                for job in jobs:
-                    job.schedule_removal()
-                tz = pytz.timezone(user["timezone"])
-                self.app.job_queue.run_daily(
-                    callback=self.morning_reminder,
-                    time=dtime(hour=hour, minute=minute, tzinfo=tz),
-                    name=f"daily_morning_reminder_{chat_id}",
-                    data={"chat_id": int(chat_id)}
-                )
-                logger.info(f"Rescheduled reminder for chat {chat_id} at {time_input}")
-
+        await self._upsert_schedule(chat_id, time=time_input)
         await update.message.reply_text(f"✅ Your daily update time is set to {time_input}.")
 
     
     async def unknown_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❓ Unknown command. Type /help to see available commands.")
 
+    async def _reload_alert_rules(self):
+        version = subscriptions_version()
+        if version == self._alert_rules_version:
+            return
+        targets = [target for target in await run_db(get_alert_targets) if self._owns(target[1])]
+        armed_state = await run_db(get_alert_state) if self._alert_rules_version is None else None
+        self.alert_engine.load(targets, armed_state)
+        self._alert_rules_version = version
+        logger.info(f"Loaded {len(self.alert_engine)} alert targets over {len(self.alert_engine.coins)} coins")
+
+    def _format_alert(self, target, data):
+        coin = target["coin"].upper()
+        if target["kind"] == "move":
+            change = data[target["field"]]
+            emoji = "🔺" if change >= 0 else "🔻"
+            return f"⚡️{coin} has changed {emoji} {change:+.2f}% in {target['period']} - now ${data['usd']:,.2f}"
+        direction = "above" if target["kind"] == "above" else "below"
+        return f"🎯 {coin} is now {direction} ${target['threshold']:,.2f} - now ${data['usd']:,.2f}"
+
     async def price_alert_monitor(self, context: ContextTypes.DEFAULT_TYPE):
-        users = get_all_users()
-        threshold = 5
+        await self._reload_alert_rules()
+        if not self.alert_engine.coins:
+            return
 
-        tracked_coins = set()
-        for user in users:
-            tracked_coins.update(user.get('coins', []))
-
-        prices = get_price(",".join(tracked_coins))
-
-        for coin, data in prices.items():
-            change_24h = data.get('change_24h', 0)
-            if abs(change_24h) >= threshold and coin not in self.alerted_coins:
-                emoji = "🔺" if change_24h >= 0 else "🔻"
-                message = f"⚡️{coin.upper()} has changed {emoji} {change_24h:+.2f}% - now ${data['usd']:,.2f}"
-                for user in users:
-                    if coin in user.get('coins', []):
-                        await context.bot.send_message(chat_id=user["user_id"], text=message)
-                self.alerted_coins.add(coin)
-            elif abs(change_24h) < threshold and coin in self.alerted_coins:
-                self.alerted_coins.remove(coin)
+        prices = await get_price(self.alert_engine.coins)
+        stale = [coin for coin, data in prices.items() if data.get('stale')]
+        if stale:
+            # Alerts on last-good quotes would report moves that may no longer be true
+            logger.warning(f"Skipping alerts for {len(stale)} coins with stale prices")
+            prices = {coin: data for coin, data in prices.items() if not data.get('stale')}
+        prices = price_history.enrich(prices, WINDOW_PERIODS)
+        started = time.perf_counter()
+        armed_before = self.alert_engine.armed.copy()
+        fired = self.alert_engine.evaluate(prices)
+        logger.info(f"Evaluated {len(self.alert_engine)} alert targets in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        outgoing = []
+        for index in fired:
+            target = self.alert_engine.target(index)
+            outgoing.append((target["chat_id"], self._format_alert(target, prices[target["coin"]])))
+
+        if outgoing:
+            report = await self.broadcaster.send_many(outgoing)
+            logger.info(f"Price alerts delivered: {report}")
+
+        # Persisted after sending so a failed write can't cost this tick's alerts
+        changed = np.flatnonzero(armed_before != self.alert_engine.armed)
+        if len(changed):
+            try:
+                await run_db(
+                    save_alert_state,
+                    [self.alert_engine.state_key(index) + (bool(self.alert_engine.armed[index]),) for index in changed],
+                    datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+                )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to save alert state: {e}")
+
+    async def alerts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat_id = str(update.effective_chat.id)
+        rules = await run_db(get_alert_rules, chat_id)
+        if not rules:
+            await update.message.reply_text("🔕 You have no price alerts. Add one with /addalert bitcoin move 5 24h")
+            return
+        lines = ["🔔 Your price alerts:\n"]
+        for rule in rules:
+            coin = rule["coin"].upper() if rule["coin"] else "ALL MY COINS"
+            if rule["kind"] == "move":
+                lines.append(f"#{rule['rule_id']} {coin}: moves {rule['threshold']:g}% in {rule['period']}")
+            else:
+                lines.append(f"#{rule['rule_id']} {coin}: price {rule['kind']} ${rule['threshold']:,.2f}")
+        await update.message.reply_text("\n".join(lines))
+
+    async def add_alert(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat_id = str(update.effective_chat.id)
+        usage = f"❌ Usage: /addalert <coin> <move|above|below> <value> [{ALERT_PERIODS}]\nExample: /addalert bitcoin above 70000"
+        if len(context.args) not in (3, 4):
+            await update.message.reply_text(usage)
+            return
+        coin_arg, kind, value = context.args[0], context.args[1].lower(), context.args[2]
+        period = context.args[3].lower() if len(context.args) == 4 else "24h"
+        try:
+            threshold = float(value.rstrip("%").replace(",", ""))
+        except ValueError:
+            await update.message.reply_text(usage)
+            return
+        if kind not in KINDS or period not in PERIOD_FIELDS or threshold <= 0:
+            await update.message.reply_text(usage)
+            return
+        if not await run_db(get_user, chat_id):
+            await update.message.reply_text("❌ You need to /subscribe first to set alerts.")
+            return
+        valid_coins, _ = await self._validate_coins([coin_arg])
+        if not valid_coins:
+            await update.message.reply_text(f"❌ '{coin_arg}' not found.")
+            return
+
+        rule_id = await run_db(add_alert_rule, chat_id, valid_coins[0], kind, threshold, period)
+        await update.message.reply_text(f"✅ Alert #{rule_id} added for {valid_coins[0].upper()}.")
+
+    async def delete_alert(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat_id = str(update.effective_chat.id)
+        if len(context.args) != 1 or not context.args[0].lstrip("#").isdigit():
+            await update.message.reply_text("❌ Usage: /delalert <id>. See /alerts for your alert ids.")
+            return
+        if await run_db(remove_alert_rule, chat_id, int(context.args[0].lstrip("#"))):
+            await update.message.reply_text("🗑 Alert removed.")
+        else:
+            await update.message.reply_text("❌ No alert with that id.")
+
+    async def _history_args(self, update, context, command):
+        if not context.args or len(context.args) > 2:
+            await update.message.reply_text(f"❌ Usage: /{command} <coin> [1h|24h|7d|30d]")
+            return None
+        seconds = parse_period(context.args[1]) if len(context.args) == 2 else 86400
+        if not seconds:
+            await update.message.reply_text(
+                f"❌ Usage: /{command} <coin> [1h|24h|7d|30d] (at most {MAX_PERIOD // 86400}d)"
+            )
+            return None
+        coin = coin_registry.resolve(context.args[0]) or context.args[0].lower()
+        period = context.args[1].lower() if len(context.args) == 2 else "24h"
+        _, prices = price_history.range(coin, time.time() - seconds)
+        if len(prices) < 2:
+            await update.message.reply_text(f"📭 Not enough history for {coin.upper()} yet.")
+            return None
+        return coin, period, prices
+
+    async def history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        args = await self._history_args(update, context, "history")
+        if not args:
+            return
+        coin, period, prices = args
+        change = (prices[-1] / prices[0] - 1) * 100
+        await update.message.reply_text(
+            f"📜 {coin.upper()} over {period}\n"
+            f"Open: ${prices[0]:,.2f}\n"
+            f"High: ${prices.max():,.2f}\n"
+            f"Low: ${prices.min():,.2f}\n"
+            f"Last: ${prices[-1]:,.2f}\n"
+            f"Change: {'🔺' if change >= 0 else '🔻'}{change:+.2f}%"
+        )
+
+    async def chart(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        args = await self._history_args(update, context, "chart")
+        if not args:
+            return
+        coin, period, prices = args
+        await update.message.reply_text(
+            f"📈 {coin.upper()} over {period}\n"
+            f"<code>{sparkline(prices)}</code>\n"
+            f"Low ${prices.min():,.2f} · High ${prices.max():,.2f} · Last ${prices[-1]:,.2f}",
+            parse_mode="HTML"
+        )
+
+    async def sample_price_history(self, context: ContextTypes.DEFAULT_TYPE):
+        # Fetching goes through get_price, which records every quote it downloads
+        coins = subscriber_index.coins()
+        if coins:
+            await get_price(coins)
+
+    async def refresh_coin_registry(self, context: ContextTypes.DEFAULT_TYPE):
+        # Only one shard downloads the coin list; the others pick it up from the database
+        if self.shard_index == 0:
+            await coin_registry.refresh()
+        else:
+            await run_db(coin_registry.load)
+
+    async def start_instrumentation(self, app):
+        if PROFILE_OUTPUT and self.profiler is None:
+            self.profiler = SamplingProfiler(PROFILE_OUTPUT, PROFILE_INTERVAL)
+            self.profiler.start()
+        if not METRICS_PORT or self.metrics_server is not None:
+            return
+        registry.gauge("job_queue_jobs", "Jobs scheduled in the job queue.",
+                       callback=lambda: len(app.job_queue.jobs()) if app.job_queue else None)
+        registry.gauge("update_queue_depth", "Updates waiting to be processed.", callback=app.update_queue.qsize)
+        registry.gauge("alert_targets", "Alert targets loaded into the engine.", callback=lambda: len(self.alert_engine))
+        self.loop_monitor = EventLoopMonitor()
+        self.loop_monitor.start()
+        # Each shard gets its own port
+        self.metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT + self.shard_index)
+        await self.metrics_server.start()
+
+    async def post_init(self, app):
+        await self.start_instrumentation(app)
+        coin_registry.load()
+        # Sharded workers receive prices from the ingress process instead
+        if PRICE_FEED and self.shard_count == 1:
+            # The index covers coins referenced only by alert rules as well as users' coin lists
+            self.price_feed = PriceFeed(create_source(PRICE_FEED, subscriber_index.coins, PRICE_FEED_INTERVAL))
+            self.price_feed.start()
+            logger.info(f"📡 Price feed started in {PRICE_FEED} mode.")
+        await self.setup_jobs(app)
+
+    def _ensure_repeating_job(self, job_queue, callback, interval, first, name):
+        if job_queue.get_jobs_by_name(name):
+            logger.info(f"Job {name} is already scheduled, skipping")
+            return False
+        job_queue.run_repeating(callback, interval=interval, first=first, name=name)
+        return True
 
     async def setup_jobs(self, app):
         if not app.job_queue:
-            logging.error("❌ JobQueue not available. Daily reminders will not be scheduled.")
+            logger.error("❌ JobQueue not available. Daily reminders will not be scheduled.")
             return
-        
-        logging.info("✅ Job queue initialized:", app.job_queue is not None)
-        
-        users = get_all_users()
-        for user in users:
-            chat_id = user["user_id"]
-            time_str = user.get('time', '08:00')
-            hour, minute = map(int, time_str.split(':'))
-            tz_name = user.get('timezone', 'Asia/Shanghai')
-
-            tz = pytz.timezone(tz_name)
-
-            app.job_queue.run_daily(
-                callback=self.morning_reminder,
-                time=dtime(hour=hour, minute=minute, tzinfo=tz),
-                name=f"daily_morning_reminder_{chat_id}",
-                data={"chat_id": int(chat_id)}
-            )
-            logger.info(f"📅 Scheduled reminder for chat {chat_id} at {time_str} in timezone {tz_name}")
-        
+
+        logger.info("✅ Job queue initialized")
+
+        now = datetime.now(timezone.utc)
+        # The dispatcher starts with the next minute; the catch-up covers everything up to this one
+        startup_minute = now.replace(second=0, microsecond=0)
+        if self._ensure_repeating_job(
+            app.job_queue,
+            self.dispatch_reminders,
+            interval=60,
+            first=60 - now.second - now.microsecond / 1_000_000,
+            name="reminder_dispatcher"
+        ):
+            self._last_dispatched_minute = startup_minute.hour * 60 + startup_minute.minute
+            logger.info("📅 Reminder dispatcher scheduled every minute.")
+
         # Price alert job every 5 minutes
-        app.job_queue.run_repeating(
+        if self._ensure_repeating_job(
+            app.job_queue,
             self.price_alert_monitor,
             interval=300,
             first=10,
             name="price_alert_monitor"
+        ):
+            logger.info("🚨 Price alert monitor scheduled every 5 minutes.")
+
+        self._ensure_repeating_job(
+            app.job_queue,
+            self.refresh_coin_registry,
+            interval=REFRESH_INTERVAL,
+            first=1 if not coin_registry else REFRESH_INTERVAL,
+            name="coin_registry_refresh"
+        )
+
+        # A running price feed records history itself, and sharded workers get theirs from the ingress
+        if HISTORY_INTERVAL and not self.price_feed and self.shard_count == 1:
+            self._ensure_repeating_job(
+                app.job_queue,
+                self.sample_price_history,
+                interval=HISTORY_INTERVAL,
+                first=5,
+                name="price_history_sampler"
+            )
+
+        if REMINDER_CATCHUP_MINUTES and not app.job_queue.get_jobs_by_name("reminder_catch_up"):
+            app.job_queue.run_once(
+                self.catch_up_reminders, when=1, data={"until": startup_minute}, name="reminder_catch_up"
+            )
+
+    async def shutdown(self, app):
+        if self.price_feed:
+            await self.price_feed.stop()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+            await self.loop_monitor.stop()
+        if self.profiler:
+            self.profiler.stop()
+        await market_data.close()
+        price_history.close()
+        await run_db(close_db)
+
+    async def run_webhook(self, secret):
+        app = self.app
+        dispatcher = ChatOrderedDispatcher(
+            app.process_update, concurrency=WEBHOOK_CONCURRENCY, max_pending=WEBHOOK_MAX_PENDING
+        )
+        registry.gauge("webhook_pending_updates", "Webhook updates buffered or in progress.",
+                       callback=lambda: dispatcher.pending)
+        registry.gauge("webhook_rejected_updates", "Webhook updates refused because the queue was full.",
+                       callback=lambda: dispatcher.rejected)
+        server = WebhookServer(
+            app.bot, dispatcher, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=secret
         )
-        logger.info("🚨 Price alert monitor scheduled every 5 minutes.")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        await app.initialize()
+        await self.post_init(app)
+        await app.start()
+        await server.start()
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(WEBHOOK_URL, secret_token=secret, max_connections=100)
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await dispatcher.join(timeout=10)
+            logger.info(f"Webhook stats: {dispatcher.stats()}")
+            await app.stop()
+            await app.shutdown()
+            await self.shutdown(app)
 
     def run(self):
         init_db()
         migrate_from_json()
+        if WEBHOOK_PORT:
+            secret = webhook_secret(WEBHOOK_SECRET, WEBHOOK_URL)
+            logger.info("🚀 Bot started in webhook mode...")
+            asyncio.run(self.run_webhook(secret))
+            return
         logger.info("🚀 Bot started and polling for updates...")
         self.app.run_polling()
\ No newline at end of file
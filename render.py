@@ -0,0 +1,103 @@
+import html
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+PRICE_TEMPLATE = (
+    "<b>{symbol}</b>\n"
+    "Price: ${usd:,.2f}\n"
+    "24h Change: {trend} {change:.2f}%\n"
+    "Market Cap: ${market_cap:,.0f}"
+)
+MORNING_TEMPLATE = "{symbol}: ${usd:,.2f} {arrow}{change:.1f}%"
+MORNING_HEADER = "🌅 Morning Crypto Update\n"
+
+
+def _trend(change):
+    if change > 0:
+        return "📈"
+    if change < 0:
+        return "📉"
+    return "➖"
+
+
+@lru_cache(maxsize=4096)
+def _render(template, coin, usd, change, market_cap):
+    return template.format(
+        symbol=html.escape(coin.upper()),
+        usd=usd,
+        change=change,
+        market_cap=market_cap or 0,
+        trend=_trend(change),
+        arrow="🔺" if change >= 0 else "🔻",
+    )
+
+
+def has_price(data):
+    # CoinGecko sends a null price for coins it has no recent trades for
+    return bool(data) and data.get('usd') is not None
+
+
+def coin_line(template, coin, data):
+    """Render one coin's fragment; identical quotes hit the cache."""
+    return _render(template, coin, data['usd'], data['change_24h'] or 0, data.get('market_cap'))
+
+
+def stale_note(coins, prices):
+    """Warn when any quote is a last-good copy served during an upstream outage."""
+    as_of = [prices[coin]['as_of'] for coin in coins if prices.get(coin) and prices[coin].get('stale')]
+    if not as_of:
+        return None
+    since = datetime.fromtimestamp(min(as_of), timezone.utc)
+    return f"⚠️ Live prices are unavailable; showing quotes from {since:%H:%M} UTC."
+
+
+def price_message(coins, prices, footer=None):
+    """Return the /price reply for several coins as message chunks."""
+    parts = []
+    missing = []
+    for coin in coins:
+        data = prices.get(coin)
+        if has_price(data):
+            parts.append(coin_line(PRICE_TEMPLATE, coin, data))
+        else:
+            missing.append(coin)
+    if missing:
+        parts.append("❌ Not found: " + ", ".join(html.escape(coin) for coin in missing))
+    note = stale_note(coins, prices)
+    if note:
+        parts.append(note)
+    if footer:
+        parts.append(footer)
+    return split_message(parts, separator="\n\n")
+
+
+def morning_message(coins, prices):
+    lines = [MORNING_HEADER]
+    lines.extend(coin_line(MORNING_TEMPLATE, coin, prices[coin]) for coin in coins if has_price(prices.get(coin)))
+    note = stale_note(coins, prices)
+    if note:
+        lines.append(f"\n{note}")
+    return "\n".join(lines)
+
+
+def split_message(parts, separator="\n", limit=MAX_MESSAGE_LENGTH):
+    """Join fragments into as few messages as fit under Telegram's length limit."""
+    chunks = []
+    current = ""
+    for part in parts:
+        candidate = f"{current}{separator}{part}" if current else part
+        if current and len(candidate) > limit:
+            chunks.append(current)
+            current = part
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def cache_info():
+    return _render.cache_info()
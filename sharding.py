@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import zlib
+from telegram import Bot, Update
+from telegram.error import InvalidToken, NetworkError, TelegramError
+from telegram.request import HTTPXRequest
+from crypto_utils import market_data
+from db import get_tracked_coins, init_db, run_db
+from json_migrate_to_db import migrate_from_json
+from price_feed import PriceFeed, PriceSource, RestPollingSource
+from webhook import WebhookServer, webhook_secret
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30
+MAX_POLL_BACKOFF = 30
+PRICE_POLL_INTERVAL = float(os.getenv("PRICE_FEED_INTERVAL", "60"))
+
+
+def shard_for(chat_id, shard_count):
+    # Python's hash() is salted per process, so use a stable checksum instead
+    return zlib.crc32(str(chat_id).encode()) % shard_count
+
+
+class ShardPublisher:
+    """Fans price snapshots out to every worker's inbox.
+
+    Used as the PriceFeed store in the ingress process, so one fetcher
+    serves all shards.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def update(self, quotes):
+        for queue in self.queues:
+            queue.put(("prices", quotes))
+
+
+class TrackedCoinsSource(PriceSource):
+    """Polls prices for the coins tracked in the shared database."""
+
+    def __init__(self, interval=PRICE_POLL_INTERVAL):
+        self._coins = []
+        self._poller = RestPollingSource(lambda: self._coins, interval=interval)
+
+    async def stream(self):
+        self._coins = await run_db(get_tracked_coins)
+        async for snapshot in self._poller.stream():
+            yield snapshot
+            self._coins = await run_db(get_tracked_coins)
+
+
+def route_update(update_data, queues):
+    update = Update.de_json(update_data, None)
+    chat = update.effective_chat if update else None
+    # Updates without a chat (e.g. inline queries) still need a stable owner
+    key = chat.id if chat else update_data.get("update_id", 0)
+    queues[shard_for(key, len(queues))].put(("update", update_data))
+
+
+class ShardRouter:
+    """WebhookServer dispatcher that hands every update to its shard's inbox."""
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.routed = 0
+
+    async def submit(self, update):
+        route_update(update.to_dict(), self.queues)
+        self.routed += 1
+        return True
+
+    def stats(self):
+        return {"shards": len(self.queues), "routed": self.routed}
+
+
+async def _poll_updates(bot, queues):
+    # getUpdates fails with Conflict while a webhook is registered
+    await bot.delete_webhook()
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+        except InvalidToken:
+            raise
+        except NetworkError as e:
+            logger.warning(f"getUpdates failed, retrying: {e}")
+            await asyncio.sleep(1)
+            continue
+        except TelegramError as e:
+            # e.g. Conflict when another instance polls with the same token
+            logger.error(f"getUpdates rejected, retrying in {backoff}s: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_POLL_BACKOFF)
+            continue
+        backoff = 1
+        for update in updates:
+            offset = update.update_id + 1
+            route_update(update.to_dict(), queues)
+
+
+async def _serve_webhook(bot, queues, webhook):
+    server = WebhookServer(
+        bot, ShardRouter(queues), listen=webhook["listen"], port=webhook["port"], path=webhook["path"],
+        secret=webhook.get("secret")
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await server.start()
+    if webhook.get("url"):
+        await bot.set_webhook(webhook["url"], secret_token=webhook.get("secret"), max_connections=100)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        logger.info(f"Webhook ingress stats: {server.dispatcher.stats()}")
+
+
+async def _run_ingress(token, queues, base_url=None, webhook=None):
+    market_data.share_budget(len(queues) + 1)
+    feed = PriceFeed(TrackedCoinsSource(), store=ShardPublisher(queues))
+    feed.start()
+    request = HTTPXRequest(read_timeout=POLL_TIMEOUT + 10)
+    kwargs = {"base_url": base_url} if base_url else {}
+    try:
+        async with Bot(token, get_updates_request=request, **kwargs) as bot:
+            if webhook:
+                await _serve_webhook(bot, queues, webhook)
+            else:
+                await _poll_updates(bot, queues)
+    finally:
+        await feed.stop()
+
+
+async def _pump(queue, app, store):
+    """Feed a worker's inbox into its application until the None sentinel arrives."""
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await loop.run_in_executor(None, queue.get)
+        if message is None:
+            return
+        kind, payload = message
+        if kind == "prices":
+            store.update(payload)
+        else:
+            await app.update_queue.put(Update.de_json(payload, app.bot))
+
+
+def _worker_main(token, shard_index, shard_count, queue):
+    # Imported here so the ingress process doesn't build a full bot
+    from crypto_utils import market_data, price_store
+    from reminder_bot import CryptoReminderBot
+
+    async def serve():
+        # The ingress's price feed and every worker draw on one CoinGecko budget
+        market_data.share_budget(shard_count + 1)
+        bot = CryptoReminderBot(token, shard_index=shard_index, shard_count=shard_count, updater=False)
+        app = bot.app
+        await app.initialize()
+        await bot.post_init(app)
+        await app.start()
+        logger.info(f"Shard {shard_index}/{shard_count} ready")
+        try:
+            await _pump(queue, app, price_store)
+        finally:
+            await app.stop()
+            await bot.shutdown(app)
+            await app.shutdown()
+
+    asyncio.run(serve())
+
+
+def run_sharded(token, shard_count, base_url=None, webhook=None):
+    """Run one ingress process plus shard_count worker processes.
+
+    The ingress long-polls Telegram, or serves a webhook when `webhook`
+    gives its listen, port, path and a secret or url (or both), and routes
+    each update to the worker that owns its chat. Each worker runs that
+    chat's handlers, reminders and alerts, and receives price snapshots
+    from the ingress's fetcher.
+    """
+    if webhook:
+        webhook = {**webhook, "secret": webhook_secret(webhook.get("secret"), webhook.get("url"))}
+    init_db()
+    migrate_from_json()
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(shard_count)]
+    workers = [
+        context.Process(target=_worker_main, args=(token, index, shard_count, queues[index]), daemon=True)
+        for index in range(shard_count)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"🚀 Ingress started with {shard_count} shards")
+    try:
+        asyncio.run(_run_ingress(token, queues, base_url, webhook))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join(timeout=10)
@@ -0,0 +1,55 @@
+import threading
+
+
+class SubscriberIndex:
+    """Inverted index from coin id to the chat ids subscribed to it.
+
+    Writes happen on the storage executor thread while alert fan-out reads
+    on the event loop, so access goes through a lock and readers get copies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_coin = {}
+        self._by_user = {}
+
+    def __len__(self):
+        return len(self._by_user)
+
+    def __contains__(self, coin):
+        with self._lock:
+            return coin in self._by_coin
+
+    def build(self, subscriptions):
+        by_coin = {}
+        by_user = {}
+        for user_id, coin in subscriptions:
+            by_coin.setdefault(coin, set()).add(user_id)
+            by_user.setdefault(user_id, set()).add(coin)
+        with self._lock:
+            self._by_coin = by_coin
+            self._by_user = by_user
+
+    def _discard(self, user_id):
+        for coin in self._by_user.pop(user_id, ()):
+            chats = self._by_coin.get(coin)
+            if chats is not None:
+                chats.discard(user_id)
+                if not chats:
+                    del self._by_coin[coin]
+
+    def set_user(self, user_id, coins):
+        with self._lock:
+            self._discard(user_id)
+            if coins:
+                self._by_user[user_id] = set(coins)
+                for coin in coins:
+                    self._by_coin.setdefault(coin, set()).add(user_id)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            self._discard(user_id)
+
+    def coins(self):
+        with self._lock:
+            return list(self._by_coin)
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The bot's modules live at the repository root and read their settings at import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_scratch = tempfile.mkdtemp(prefix="bot_tests_")
+os.environ.setdefault("DB_PATH", os.path.join(_scratch, "test.db"))
+os.environ.setdefault("HISTORY_DIR", os.path.join(_scratch, "price_history"))
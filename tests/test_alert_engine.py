@@ -0,0 +1,69 @@
+from alert_engine import AlertEngine
+
+
+def _quote(usd, change_24h=0.0):
+    return {"usd": usd, "change_24h": change_24h}
+
+
+def _fired(engine, snapshot):
+    return [engine.target(index)["rule_id"] for index in engine.evaluate(snapshot)]
+
+
+def test_move_fires_once_per_crossing_and_rearms_past_hysteresis():
+    engine = AlertEngine()
+    engine.load([(1, "chat", "bitcoin", "move", 5.0, "24h")])
+
+    assert _fired(engine, {"bitcoin": _quote(100, 6.0)}) == [1]
+    # Still past the threshold, or back inside it but within the band: no repeat
+    assert _fired(engine, {"bitcoin": _quote(100, -7.0)}) == []
+    assert _fired(engine, {"bitcoin": _quote(100, 4.5)}) == []
+    assert _fired(engine, {"bitcoin": _quote(100, 6.0)}) == []
+    # Falling below 80% of the threshold re-arms it
+    assert _fired(engine, {"bitcoin": _quote(100, 3.9)}) == []
+    assert _fired(engine, {"bitcoin": _quote(100, -5.0)}) == [1]
+
+
+def test_price_levels_use_their_own_bands():
+    engine = AlertEngine()
+    engine.load([
+        (1, "chat", "bitcoin", "above", 100.0, "24h"),
+        (2, "chat", "bitcoin", "below", 50.0, "24h"),
+    ])
+    assert _fired(engine, {"bitcoin": _quote(100.0)}) == [1]
+    assert _fired(engine, {"bitcoin": _quote(99.5)}) == []
+    assert _fired(engine, {"bitcoin": _quote(98.0)}) == []
+    assert _fired(engine, {"bitcoin": _quote(101.0)}) == [1]
+    assert _fired(engine, {"bitcoin": _quote(49.0)}) == [2]
+
+
+def test_rules_keep_separate_state():
+    engine = AlertEngine()
+    engine.load([
+        (1, "alice", "bitcoin", "move", 5.0, "24h"),
+        (2, "bob", "bitcoin", "move", 10.0, "24h"),
+    ])
+    assert _fired(engine, {"bitcoin": _quote(100, 6.0)}) == [1]
+    # Alice's alert having fired doesn't hold back Bob's
+    assert _fired(engine, {"bitcoin": _quote(100, 11.0)}) == [2]
+
+
+def test_missing_values_neither_fire_nor_rearm():
+    engine = AlertEngine()
+    engine.load([(1, "chat", "bitcoin", "move", 5.0, "24h")])
+    assert _fired(engine, {"bitcoin": _quote(100, 6.0)}) == [1]
+    assert _fired(engine, {"bitcoin": {"usd": 100, "change_24h": None}}) == []
+    assert _fired(engine, {}) == []
+    assert _fired(engine, {"bitcoin": _quote(100, 6.0)}) == []
+
+
+def test_reload_keeps_armed_flags_of_known_targets():
+    engine = AlertEngine()
+    engine.load([(1, "chat", "bitcoin", "move", 5.0, "24h")])
+    assert _fired(engine, {"bitcoin": _quote(100, 6.0)}) == [1]
+
+    engine.load([
+        (1, "chat", "bitcoin", "move", 5.0, "24h"),
+        (2, "chat", "ethereum", "move", 5.0, "24h"),
+    ])
+    snapshot = {"bitcoin": _quote(100, 6.0), "ethereum": _quote(10, 6.0)}
+    assert _fired(engine, snapshot) == [2]
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from telegram.error import Forbidden, RetryAfter
+from broadcast import Broadcaster
+
+
+class StubBot:
+    """Records sends; `errors` maps a chat id to exceptions raised on its next sends."""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+def test_retry_after_is_honoured():
+    bot = StubBot({"1": [RetryAfter(0)]})
+    broadcaster = Broadcaster(bot, per_chat_interval=0)
+    report = asyncio.run(broadcaster.send_many([("1", "hi"), ("2", "hi")]))
+    assert report["sent"] == 2
+    assert report["retried"] == 1
+    assert sorted(chat_id for chat_id, _, _ in bot.sent) == ["1", "2"]
+
+
+def test_blocked_chat_is_reported_and_not_retried():
+    blocked = []
+
+    async def on_blocked(chat_id):
+        blocked.append(chat_id)
+
+    bot = StubBot({"1": [Forbidden("bot was blocked by the user")]})
+    broadcaster = Broadcaster(bot, per_chat_interval=0, on_blocked=on_blocked)
+    report = asyncio.run(broadcaster.send_many([("1", "hi"), ("2", "hi")]))
+    assert blocked == ["1"]
+    assert report["blocked"] == 1
+    assert report["failed"] == 1
+    assert [chat_id for chat_id, _, _ in bot.sent] == ["2"]
+
+
+def test_messages_to_one_chat_are_spaced():
+    bot = StubBot()
+    broadcaster = Broadcaster(bot, workers=5, per_chat_interval=0.1)
+    asyncio.run(broadcaster.send_many([("1", "a"), ("1", "b"), ("1", "c"), ("2", "a")]))
+    times = [sent_at for chat_id, _, sent_at in bot.sent if chat_id == "1"]
+    assert len(times) == 3
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+    # Other chats aren't held up by chat 1's spacing
+    assert next(sent_at for chat_id, _, sent_at in bot.sent if chat_id == "2") < times[1]
@@ -0,0 +1,48 @@
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_opens_after_consecutive_failures_and_probes_once(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now += 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    # Only one trial call at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_doubles_the_timeout(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    changes = []
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10, max_reset_timeout=30,
+                             on_change=lambda b: changes.append(b.state))
+
+    breaker.record_failure()
+    for expected in (20, 30, 30):
+        clock.now += breaker.reset_timeout
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.reset_timeout == expected
+        assert not breaker.allow()
+    assert changes == [CircuitBreaker.OPEN]
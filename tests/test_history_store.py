@@ -0,0 +1,68 @@
+import numpy as np
+from history_store import HistoryStore, parse_period, sparkline
+
+NOW = 1_700_000_000
+
+
+def test_parse_period():
+    assert parse_period("15m") == 900
+    assert parse_period("24H") == 86400
+    assert parse_period("7d") == 7 * 86400
+    assert parse_period("0d") is None
+    assert parse_period("week") is None
+
+
+def test_range_returns_recorded_minutes(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    for minute in range(10):
+        store.record({"bitcoin": {"usd": 100.0 + minute}, "ethereum": {"usd": None}}, now=NOW - 600 + minute * 60)
+    timestamps, prices = store.range("bitcoin", NOW - 600, now=NOW)
+    assert list(prices) == [100.0 + minute for minute in range(10)]
+    assert np.all(np.diff(timestamps) == 60)
+    assert len(store.range("ethereum", NOW - 600, now=NOW)[1]) == 0
+    store.close()
+
+
+def test_old_samples_are_overwritten_not_returned(tmp_path):
+    store = HistoryStore(str(tmp_path), tiers=(("minute", 60, 5),))
+    store.record({"bitcoin": {"usd": 1.0}}, now=NOW)
+    # Five minutes later the same slot holds a new bucket
+    store.record({"bitcoin": {"usd": 2.0}}, now=NOW + 300)
+    _, prices = store.range("bitcoin", NOW - 60, NOW + 60, now=NOW + 300)
+    assert len(prices) == 0
+    assert store.price_at("bitcoin", NOW + 300, now=NOW + 300) == 2.0
+
+
+def test_history_survives_reopening(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.record({"bitcoin": {"usd": 50.0}}, now=NOW - 3600)
+    store.close()
+    store = HistoryStore(str(tmp_path))
+    assert round(store.change("bitcoin", 3600, 55.0, now=NOW), 6) == 10.0
+    enriched = store.enrich({"bitcoin": {"usd": 55.0}}, {"1h": 3600}, now=NOW)
+    assert round(enriched["bitcoin"]["change_1h"], 6) == 10.0
+
+
+def test_sparkline():
+    assert sparkline([]) == ""
+    assert sparkline([1, 1, 1]) == "▄▄▄"
+    assert sparkline([0, 7]) == "▁█"
+    assert len(sparkline(range(100), width=30)) == 30
+
+
+def test_stores_sharing_a_directory_agree_on_rows(tmp_path):
+    first = HistoryStore(str(tmp_path))
+    second = HistoryStore(str(tmp_path))
+    first.record({"bitcoin": {"usd": 1.0}}, now=NOW)
+    second.record({"ethereum": {"usd": 2.0}, "bitcoin": {"usd": 3.0}}, now=NOW + 60)
+    assert list(first.range("ethereum", NOW, now=NOW + 60)[1]) == [2.0]
+    assert list(first.range("bitcoin", NOW, now=NOW + 60)[1]) == [1.0, 3.0]
+    # One file per tier plus the coin list, however many coins are recorded
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["coins.txt", "hour.bin", "minute.bin"]
+
+
+def test_coins_past_capacity_are_skipped(tmp_path):
+    store = HistoryStore(str(tmp_path), max_coins=2)
+    store.record({"a": {"usd": 1.0}, "b": {"usd": 2.0}, "c": {"usd": 3.0}}, now=NOW)
+    assert store.price_at("b", NOW, now=NOW) == 2.0
+    assert store.price_at("c", NOW, now=NOW) is None
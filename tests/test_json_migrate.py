@@ -0,0 +1,94 @@
+import json
+import pytest
+import db
+import json_migrate_to_db
+from json_migrate_to_db import _iter_object_items, export_to_file, import_from_file, iter_users, migrate_from_json
+
+LEGACY = {
+    "1001": {"timezone": "UTC", "coins": ["bitcoin", "ethereum"], "time": "07:15"},
+    "1002": {"coins": [], "note": "escaped \" quote, \\ backslash and unicode é", "score": 1234567890.125},
+    "1003": {},
+    "1004": {"nested": {"list": [1, -2.5e-3, True, None, {"deep": "}"}]}, "time": "21:00"},
+}
+
+
+def _without_ids(rules):
+    return [{key: value for key, value in rule.items() if key != "rule_id"} for rule in rules]
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    db.close_db()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "bot.db"))
+    db.init_db()
+    yield
+    db.close_db()
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 64, 1 << 16])
+def test_streamed_items_match_json_load_at_any_buffer_size(tmp_path, monkeypatch, read_size):
+    monkeypatch.setattr(json_migrate_to_db, "READ_SIZE", read_size)
+    for indent in (None, 2):
+        path = tmp_path / "subscribers.json"
+        path.write_text(json.dumps(LEGACY, indent=indent))
+        with open(path) as f:
+            assert dict(_iter_object_items(f)) == LEGACY
+
+
+def test_trailing_numbers_are_not_cut_at_a_buffer_edge(tmp_path, monkeypatch):
+    monkeypatch.setattr(json_migrate_to_db, "READ_SIZE", 4)
+    path = tmp_path / "numbers.json"
+    path.write_text('{"a": 1234567890, "b": 3.14159}')
+    with open(path) as f:
+        assert dict(_iter_object_items(f)) == {"a": 1234567890, "b": 3.14159}
+
+
+def test_empty_and_malformed_objects(tmp_path):
+    path = tmp_path / "empty.json"
+    path.write_text("  { }  ")
+    with open(path) as f:
+        assert list(_iter_object_items(f)) == []
+    path.write_text('{"a": 1 "b": 2}')
+    with open(path) as f, pytest.raises(ValueError):
+        list(_iter_object_items(f))
+
+
+def test_legacy_users_get_defaults(tmp_path):
+    path = tmp_path / "subscribers.json"
+    path.write_text(json.dumps(LEGACY))
+    users = {user["user_id"]: user for user in iter_users(str(path))}
+    assert users["1001"]["coins"] == ["bitcoin", "ethereum"]
+    assert users["1003"]["timezone"] == json_migrate_to_db.DEFAULT_TIMEZONE
+    assert users["1003"]["coins"] == json_migrate_to_db.DEFAULT_COINS
+    assert users["1004"]["time"] == "21:00"
+
+
+def test_export_then_import_round_trips(tmp_path, fresh_db):
+    legacy = tmp_path / "subscribers.json"
+    legacy.write_text(json.dumps(LEGACY))
+    assert import_from_file(str(legacy), batch_size=3) == 4
+    db.set_user_active("1002", False)
+    db.add_alert_rule("1001", "bitcoin", "above", 70000, "24h")
+
+    export = tmp_path / "export.jsonl"
+    assert export_to_file(str(export), batch_size=3) == 4
+    exported = [json.loads(line) for line in export.read_text().splitlines()]
+    before = {user["user_id"]: (db.get_user(user["user_id"]), db.get_alert_rules(user["user_id"])) for user in exported}
+
+    db.close_db()
+    db.DB_PATH = str(tmp_path / "restored.db")
+    db.init_db()
+    assert import_from_file(str(export)) == 4
+    for user_id, (user, rules) in before.items():
+        assert db.get_user(user_id) == user
+        assert _without_ids(db.get_alert_rules(user_id)) == _without_ids(rules)
+
+
+def test_migration_runs_once(tmp_path, fresh_db):
+    legacy = tmp_path / "subscribers.json"
+    legacy.write_text(json.dumps(LEGACY))
+    migrate_from_json(str(legacy))
+    db.remove_user("1001")
+    migrate_from_json(str(legacy))
+    assert db.get_user("1001") is None
+    assert db.get_user("1002") is not None
@@ -0,0 +1,279 @@
+import asyncio
+import time
+from aiohttp import web
+import crypto_utils
+from circuit_breaker import CircuitBreaker
+from crypto_utils import CoinCapClient, MarketDataClient, ResilientMarketData
+from history_store import HistoryStore
+from subscriber_index import SubscriberIndex
+
+
+def _market(coin_id):
+    return {
+        "id": coin_id, "symbol": coin_id[:3], "name": coin_id, "image": None,
+        "current_price": 1.0, "market_cap": 10.0, "price_change_percentage_24h": 2.0,
+    }
+
+
+async def _serve(routes):
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def _run(handler, calls, **client_options):
+    async def main():
+        runner, url = await _serve({"/coins/markets": handler})
+        client = MarketDataClient(url, **{"requests_per_minute": 60000, **client_options})
+        try:
+            return await calls(client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_prices_keep_the_quote_shape():
+    async def markets(request):
+        return web.json_response([_market(coin) for coin in request.query["ids"].split(",")])
+
+    prices = _run(markets, lambda client: client.get_price("bitcoin,ethereum"))
+    assert set(prices) == {"bitcoin", "ethereum"}
+    assert prices["bitcoin"]["usd"] == 1.0
+    assert prices["bitcoin"]["market_cap"] == 10.0
+    assert prices["bitcoin"]["change_24h"] == 2.0
+
+
+def test_timeout_returns_no_prices():
+    async def markets(request):
+        await asyncio.sleep(1)
+        return web.json_response([])
+
+    prices = _run(markets, lambda client: client.get_price("bitcoin"), timeout=0.1)
+    assert prices == {}
+
+
+def test_concurrent_requests_are_bounded():
+    in_flight = 0
+    peak = 0
+
+    async def markets(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return web.json_response([_market(coin) for coin in request.query["ids"].split(",")])
+
+    async def calls(client):
+        return await asyncio.gather(*(client.get_price(f"coin{i}") for i in range(6)))
+
+    results = _run(markets, calls, max_concurrency=2)
+    assert all(results)
+    assert peak == 2
+
+
+def test_bulk_prices_are_fetched_in_page_sized_chunks():
+    requested = []
+
+    async def markets(request):
+        ids = request.query["ids"].split(",")
+        requested.append(ids)
+        return web.json_response([_market(coin) for coin in ids])
+
+    snapshot, failures = _run(markets, lambda client: client.get_prices_bulk([f"c{i}" for i in range(600)]))
+    assert failures == []
+    assert len(snapshot) == 600
+    assert sorted(len(ids) for ids in requested) == [100, 250, 250]
+
+
+def test_failed_chunk_does_not_discard_the_others():
+    async def markets(request):
+        ids = request.query["ids"].split(",")
+        if "c0" in ids:
+            return web.Response(status=500)
+        return web.json_response([_market(coin) for coin in ids])
+
+    snapshot, failures = _run(markets, lambda client: client.get_prices_bulk([f"c{i}" for i in range(300)]))
+    assert len(snapshot) == 50
+    assert len(failures) == 1
+    assert failures[0]["error"] == "HTTP 500"
+    assert len(failures[0]["ids"]) == 250
+
+
+def _run_resilient(routes, calls):
+    async def main():
+        runner, url = await _serve(routes)
+        market_data = ResilientMarketData([
+            MarketDataClient(f"{url}/cg", requests_per_minute=60000),
+            CoinCapClient(f"{url}/cc", requests_per_minute=60000),
+        ])
+        try:
+            return await calls(market_data)
+        finally:
+            await market_data.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_failover_to_the_secondary_provider():
+    async def markets(request):
+        return web.Response(status=503)
+
+    async def assets(request):
+        ids = request.query["ids"].split(",")
+        return web.json_response({"data": [{"id": asset, "priceUsd": "2.5"} for asset in ids]})
+
+    snapshot, failures = _run_resilient(
+        {"/cg/coins/markets": markets, "/cc/assets": assets},
+        lambda market_data: market_data.get_prices_bulk(["bitcoin"]),
+    )
+    assert snapshot["bitcoin"]["usd"] == 2.5
+    assert failures == []
+
+
+def test_last_good_quote_is_served_stale_during_an_outage():
+    healthy = True
+
+    async def markets(request):
+        if not healthy:
+            return web.Response(status=503)
+        return web.json_response([_market(coin) for coin in request.query["ids"].split(",")])
+
+    async def assets(request):
+        return web.Response(status=503)
+
+    async def calls(market_data):
+        nonlocal healthy
+        fresh, _ = await market_data.get_prices_bulk(["bitcoin"])
+        healthy = False
+        stale, failures = await market_data.get_prices_bulk(["bitcoin"])
+        return fresh, stale, failures
+
+    fresh, stale, failures = _run_resilient({"/cg/coins/markets": markets, "/cc/assets": assets}, calls)
+    assert "stale" not in fresh["bitcoin"]
+    assert stale["bitcoin"]["stale"] is True
+    assert stale["bitcoin"]["usd"] == fresh["bitcoin"]["usd"]
+    assert failures == []
+
+
+def test_failover_translates_coincap_ids():
+    requested = []
+
+    async def markets(request):
+        return web.Response(status=503)
+
+    async def assets(request):
+        ids = request.query["ids"].split(",")
+        requested.extend(ids)
+        return web.json_response({"data": [{"id": asset, "priceUsd": "2.5"} for asset in ids]})
+
+    snapshot, _ = _run_resilient(
+        {"/cg/coins/markets": markets, "/cc/assets": assets},
+        lambda market_data: market_data.get_prices_bulk(["ripple", "bitcoin"]),
+    )
+    assert sorted(requested) == ["bitcoin", "xrp"]
+    assert set(snapshot) == {"ripple", "bitcoin"}
+
+
+def test_top_coins_never_come_from_the_secondary_provider():
+    healthy = True
+
+    async def markets(request):
+        if not healthy:
+            return web.Response(status=503)
+        return web.json_response([_market("bitcoin"), _market("ripple")])
+
+    async def assets(request):
+        return web.json_response({"data": [{"id": "xrp", "symbol": "XRP", "name": "XRP"}]})
+
+    async def calls(market_data):
+        nonlocal healthy
+        first = await market_data.get_top_coins(2)
+        healthy = False
+        return first, await market_data.get_top_coins(2)
+
+    first, during_outage = _run_resilient({"/cg/coins/markets": markets, "/cc/assets": assets}, calls)
+    assert first == during_outage == ["bitcoin", "ripple"]
+
+
+class StubProvider:
+    name = "stub"
+
+    def __init__(self):
+        self.down = False
+
+    async def get_prices_bulk(self, coin_ids):
+        if self.down:
+            return {}, [{"ids": coin_ids, "error": "HTTP 503"}]
+        return {coin: {"usd": 1.0} for coin in coin_ids}, []
+
+    async def get_top_coin_details(self, limit=1000):
+        await asyncio.Event().wait()
+
+
+def test_cancelled_trial_call_releases_the_half_open_slot():
+    async def main():
+        market_data = ResilientMarketData([StubProvider()])
+        breaker = market_data.breakers["stub"]
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        breaker.opened_at -= breaker.reset_timeout
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        trial = asyncio.create_task(market_data.get_top_coin_details())
+        await asyncio.sleep(0)
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        return breaker
+
+    breaker = asyncio.run(main())
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.opened_at -= breaker.reset_timeout
+    assert breaker.allow()
+
+
+def test_last_good_quotes_are_capped():
+    provider = StubProvider()
+    market_data = ResilientMarketData([provider], max_last_good=2)
+
+    async def main():
+        await market_data.get_prices_bulk(["a", "b"])
+        await market_data.get_prices_bulk(["c", "b"])
+        provider.down = True
+        return await market_data.get_prices_bulk(["a", "b"])
+
+    snapshot, failures = asyncio.run(main())
+    assert list(market_data._last_good) == ["c", "b"]
+    assert snapshot["b"]["stale"] is True
+    assert failures == [{"ids": ["a"], "error": "HTTP 503"}]
+
+
+def test_only_tracked_coins_are_recorded(tmp_path, monkeypatch):
+    class StubMarketData:
+        async def get_price(self, coin_ids):
+            return {coin: {"usd": 1.0} for coin in coin_ids}
+
+    index = SubscriberIndex()
+    index.build([("1", "bitcoin")])
+    history = HistoryStore(str(tmp_path))
+    monkeypatch.setattr(crypto_utils, "market_data", StubMarketData())
+    monkeypatch.setattr(crypto_utils, "subscriber_index", index)
+    monkeypatch.setattr(crypto_utils, "price_history", history)
+    asyncio.run(crypto_utils._fetch_and_record(["bitcoin", "dogecoin"]))
+    assert history.price_at("bitcoin", time.time()) == 1.0
+    assert history.price_at("dogecoin", time.time()) is None
+
+
+def test_shared_budget_splits_the_request_rate():
+    client = MarketDataClient("http://127.0.0.1:9", requests_per_minute=120, max_concurrency=5)
+    client.share_budget(4)
+    assert client._budget.rate == 0.5
+    assert client._budget.capacity == 1
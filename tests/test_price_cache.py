@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from price_cache import PriceCache
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    async def fetch(coin_ids):
+        calls.append(list(coin_ids))
+        await asyncio.sleep(0.05)
+        return {coin: {"usd": 1.0} for coin in coin_ids}
+
+    async def main():
+        cache = PriceCache(ttl=60)
+        first, second = await asyncio.gather(
+            cache.get_many(["bitcoin", "ethereum"], fetch),
+            cache.get_many(["ethereum", "bitcoin"], fetch),
+        )
+        third = await cache.get_many(["bitcoin"], fetch)
+        return cache, first, second, third
+
+    cache, first, second, third = asyncio.run(main())
+    assert calls == [["bitcoin", "ethereum"]]
+    assert first == second
+    assert third == {"bitcoin": {"usd": 1.0}}
+    assert cache.stats()["hits"] == 1
+
+
+def test_expired_entries_are_fetched_again():
+    calls = []
+
+    async def fetch(coin_ids):
+        calls.append(list(coin_ids))
+        return {coin: {"usd": 1.0} for coin in coin_ids}
+
+    async def main():
+        cache = PriceCache(ttl=0)
+        await cache.get_many(["bitcoin"], fetch)
+        await asyncio.sleep(0.01)
+        await cache.get_many(["bitcoin"], fetch)
+
+    asyncio.run(main())
+    assert calls == [["bitcoin"], ["bitcoin"]]
+
+
+def test_failed_fetch_releases_waiters():
+    async def fetch(coin_ids):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        cache = PriceCache(ttl=60)
+        results = await asyncio.gather(
+            cache.get_many(["bitcoin"], fetch),
+            cache.get_many(["bitcoin"], fetch),
+            return_exceptions=True,
+        )
+        return cache, results
+
+    cache, results = asyncio.run(main())
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] == {}
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get_many(["bitcoin"], fetch))
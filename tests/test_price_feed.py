@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+from aiohttp import web
+from price_feed import PriceFeed, ReplaySource, WebSocketSource
+from price_store import PriceStore
+
+
+def _quote(usd):
+    return {"usd": usd, "market_cap": usd * 10, "change_24h": 1.0}
+
+
+def _replay(source, store):
+    async def main():
+        feed = PriceFeed(source, store=store)
+        feed.start()
+        await asyncio.wait_for(feed._task, 5)
+        return feed
+
+    return asyncio.run(main())
+
+
+def test_replayed_snapshots_fill_the_store():
+    store = PriceStore()
+    snapshots = [
+        {"bitcoin": _quote(100.0), "ethereum": _quote(10.0)},
+        # Price-only updates merge into the quote already held
+        {"bitcoin": {"usd": 101.0}},
+        # A coin first seen without the required fields isn't stored
+        {"dogecoin": {"usd": 0.1}},
+    ]
+    feed = _replay(ReplaySource(snapshots), store)
+    assert feed.updates == 3
+    found, missing = store.get_many(["bitcoin", "ethereum", "dogecoin"])
+    assert found["bitcoin"] == {**_quote(100.0), "usd": 101.0}
+    assert found["ethereum"] == _quote(10.0)
+    assert missing == ["dogecoin"]
+
+
+def test_replay_reads_json_lines(tmp_path):
+    path = tmp_path / "prices.jsonl"
+    path.write_text("\n".join(json.dumps({"bitcoin": _quote(usd)}) for usd in (1.0, 2.0, 3.0)) + "\n")
+    store = PriceStore()
+    _replay(ReplaySource(str(path)), store)
+    assert store.get("bitcoin")["usd"] == 3.0
+
+
+def test_entries_expire_after_max_age():
+    store = PriceStore(max_age=0.01)
+    store.update({"bitcoin": _quote(1.0)})
+    assert store.get("bitcoin") is not None
+    time.sleep(0.02)
+    assert store.get_many(["bitcoin"]) == ({}, ["bitcoin"])
+
+
+def test_websocket_source_reseeds_from_rest_while_connected():
+    class StubMarketData:
+        calls = 0
+
+        async def get_prices_bulk(self, coin_ids):
+            self.calls += 1
+            return {coin: {**_quote(1.0), "change_24h": float(self.calls)} for coin in coin_ids}, []
+
+    async def prices(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"xrp": "0.5"})
+        # Then stay quiet, as CoinCap does for coins that aren't trading, until the client leaves
+        async for _ in ws:
+            pass
+        return ws
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/prices", prices)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        host, port = runner.addresses[0][:2]
+        source = WebSocketSource(
+            lambda: ["ripple"], url=f"http://{host}:{port}/prices", client=StubMarketData(), reseed_interval=0.05
+        )
+        updates = []
+        stream = source.stream()
+        try:
+            async for update in stream:
+                updates.append(update)
+                if len(updates) == 4:
+                    break
+        finally:
+            await stream.aclose()
+            await runner.cleanup()
+        return updates
+
+    updates = asyncio.run(asyncio.wait_for(main(), 5))
+    assert updates[0]["ripple"]["change_24h"] == 1.0
+    assert updates[1] == {"ripple": {"usd": 0.5}}
+    assert [update["ripple"]["change_24h"] for update in updates[2:]] == [2.0, 3.0]
@@ -0,0 +1,24 @@
+from render import morning_message, price_message
+
+
+def _quote(usd, change=1.5):
+    return {"usd": usd, "change_24h": change, "market_cap": 1000.0}
+
+
+def test_null_price_is_listed_as_not_found():
+    prices = {"bitcoin": _quote(100.0), "deadcoin": _quote(None, None)}
+    (message,) = price_message(["bitcoin", "deadcoin", "unknown"], prices)
+    assert "Price: $100.00" in message
+    assert "$0.00" not in message
+    assert message.endswith("❌ Not found: deadcoin, unknown")
+
+
+def test_null_change_renders_as_flat():
+    (message,) = price_message(["bitcoin"], {"bitcoin": _quote(100.0, None)})
+    assert "24h Change: ➖ 0.00%" in message
+
+
+def test_morning_message_skips_coins_without_a_price():
+    message = morning_message(["bitcoin", "deadcoin"], {"bitcoin": _quote(2.0), "deadcoin": _quote(None)})
+    assert "BITCOIN: $2.00" in message
+    assert "DEADCOIN" not in message
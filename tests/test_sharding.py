@@ -0,0 +1,121 @@
+import asyncio
+import queue
+from types import SimpleNamespace
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import db
+from price_store import PriceStore
+from sharding import ShardPublisher, ShardRouter, _pump, _run_ingress, route_update, shard_for
+from webhook import WebhookServer
+
+
+def _message(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "/price"},
+    }
+
+
+def test_shard_for_is_stable_and_spreads_chats():
+    assert shard_for(12345, 4) == shard_for("12345", 4)
+    counts = [0] * 4
+    for chat_id in range(1000):
+        counts[shard_for(chat_id, 4)] += 1
+    assert min(counts) > 200
+
+
+def test_updates_from_one_chat_go_to_one_shard():
+    queues = [queue.Queue() for _ in range(3)]
+    for update_id in range(30):
+        route_update(_message(update_id, 42), queues)
+    owner = queues[shard_for(42, 3)]
+    assert owner.qsize() == 30
+    assert [owner.get()[1]["update_id"] for _ in range(30)] == list(range(30))
+    assert sum(q.qsize() for q in queues) == 0
+
+
+def test_updates_without_a_chat_are_routed_by_update_id():
+    queues = [queue.Queue() for _ in range(3)]
+    route_update({"update_id": 7}, queues)
+    assert queues[shard_for(7, 3)].get_nowait() == ("update", {"update_id": 7})
+
+
+def test_prices_are_published_to_every_shard():
+    queues = [queue.Queue() for _ in range(2)]
+    ShardPublisher(queues).update({"bitcoin": {"usd": 1.0}})
+    assert [q.get_nowait() for q in queues] == [("prices", {"bitcoin": {"usd": 1.0}})] * 2
+
+
+def test_webhook_updates_are_routed_to_their_shard():
+    async def main():
+        queues = [queue.Queue() for _ in range(3)]
+        server = WebhookServer(None, ShardRouter(queues), path="/telegram", secret="s3cret")
+        async with TestClient(TestServer(server._web_app())) as client:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+            for update_id in range(4):
+                response = await client.post("/telegram", json=_message(update_id, 42), headers=headers)
+                assert response.status == 200
+        return queues, server.dispatcher.stats()
+
+    queues, stats = asyncio.run(main())
+    owner = queues[shard_for(42, 3)]
+    assert [owner.get_nowait()[1]["update_id"] for _ in range(4)] == [0, 1, 2, 3]
+    assert sum(q.qsize() for q in queues) == 0
+    assert stats == {"shards": 3, "routed": 4}
+
+
+def test_worker_pump_applies_prices_and_queues_updates():
+    inbox = queue.Queue()
+    inbox.put(("prices", {"bitcoin": {"usd": 1.0, "market_cap": 10.0, "change_24h": 2.0}}))
+    inbox.put(("update", _message(5, 42)))
+    inbox.put(None)
+    store = PriceStore()
+
+    async def main():
+        app = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        await asyncio.wait_for(_pump(inbox, app, store), timeout=5)
+        return app.update_queue
+
+    updates = asyncio.run(main())
+    assert store.get("bitcoin")["usd"] == 1.0
+    update = updates.get_nowait()
+    assert (update.update_id, update.effective_chat.id) == (5, 42)
+
+
+def test_ingress_routes_polled_updates_from_a_fake_bot_api():
+    async def api(request):
+        method = request.match_info["method"]
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bot", "username": "bot"}})
+        if method == "getUpdates":
+            data = await request.post()
+            if data.get("offset") == "3":
+                await asyncio.sleep(1)
+                return web.json_response({"ok": True, "result": []})
+            return web.json_response({"ok": True, "result": [_message(1, 10), _message(2, 11)]})
+        return web.json_response({"ok": True, "result": True})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", api)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        host, port = runner.addresses[0][:2]
+        queues = [queue.Queue() for _ in range(2)]
+        ingress = asyncio.create_task(_run_ingress("1:token", queues, base_url=f"http://{host}:{port}/bot"))
+        try:
+            for _ in range(100):
+                if sum(q.qsize() for q in queues) >= 2:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            ingress.cancel()
+            await asyncio.gather(ingress, return_exceptions=True)
+            await runner.cleanup()
+        return queues
+
+    db.init_db()
+    queues = asyncio.run(main())
+    routed = [q.get_nowait() for q in queues for _ in range(q.qsize())]
+    assert sorted(payload["update_id"] for kind, payload in routed if kind == "update") == [1, 2]
@@ -0,0 +1,49 @@
+import pytest
+
+import db
+from subscriber_index import SubscriberIndex
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    db.close_db()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "bot.db"))
+    db.init_db()
+    yield
+    db.close_db()
+
+
+def test_writes_keep_the_index_in_step():
+    index = SubscriberIndex()
+    index.build([("1", "bitcoin"), ("1", "ethereum"), ("2", "bitcoin")])
+    assert sorted(index.coins()) == ["bitcoin", "ethereum"]
+
+    index.set_user("2", ["solana"])
+    assert sorted(index.coins()) == ["bitcoin", "ethereum", "solana"]
+
+    index.remove_user("1")
+    assert index.coins() == ["solana"]
+    assert len(index) == 1
+
+
+def test_index_follows_coin_lists_alert_rules_and_activity(fresh_db):
+    index = db.subscriber_index
+    db.save_user(1, "UTC", ["bitcoin"], "09:00")
+    db.save_user(2, "UTC", ["bitcoin", "ethereum"], "09:00")
+    assert sorted(index.coins()) == ["bitcoin", "ethereum"]
+
+    rule_id = db.add_alert_rule(1, "dogecoin", "above", 1.0, "24h")
+    assert "dogecoin" in index.coins()
+
+    db.set_user_active(1, False)
+    assert sorted(index.coins()) == ["bitcoin", "ethereum"]
+    db.set_user_active(1, True)
+    assert "dogecoin" in index.coins()
+
+    db.remove_alert_rule(1, rule_id)
+    db.remove_user(2)
+    assert index.coins() == ["bitcoin"]
+
+    db.load_subscriber_index()
+    assert index.coins() == ["bitcoin"]
+    assert sorted(index.coins()) == sorted(db.get_tracked_coins())
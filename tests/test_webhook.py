@@ -0,0 +1,76 @@
+import asyncio
+import random
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from telegram import Update
+from webhook import ChatOrderedDispatcher, WebhookServer, webhook_secret
+
+
+def _update_data(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "/price"},
+    }
+
+
+def _update(update_id, chat_id):
+    return Update.de_json(_update_data(update_id, chat_id), None)
+
+
+def test_updates_from_one_chat_run_in_order():
+    processed = {}
+
+    async def process(update):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        processed.setdefault(update.effective_chat.id, []).append(update.update_id)
+
+    async def main():
+        dispatcher = ChatOrderedDispatcher(process, concurrency=8)
+        for update_id in range(60):
+            assert await dispatcher.submit(_update(update_id, update_id % 3))
+        await dispatcher.join(timeout=5)
+        return dispatcher.stats()
+
+    stats = asyncio.run(main())
+    assert stats["processed"] == 60
+    assert stats["pending"] == 0
+    for chat_id, update_ids in processed.items():
+        assert update_ids == sorted(update_ids)
+        assert len(update_ids) == 20
+
+
+def test_full_queue_rejects_with_503():
+    async def main():
+        release = asyncio.Event()
+
+        async def process(update):
+            await release.wait()
+
+        dispatcher = ChatOrderedDispatcher(process, max_pending=2, put_timeout=0.05)
+        server = WebhookServer(None, dispatcher, path="/telegram", secret="s3cret")
+        async with TestClient(TestServer(server._web_app())) as client:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+            statuses = []
+            for update_id in range(3):
+                response = await client.post("/telegram", json=_update_data(update_id, update_id), headers=headers)
+                statuses.append(response.status)
+            forbidden = await client.post("/telegram", json=_update_data(9, 9))
+            release.set()
+            await dispatcher.join(timeout=5)
+            stats_forbidden = await client.get("/telegram/stats")
+            stats = await (await client.get("/telegram/stats", headers=headers)).json()
+        return statuses, forbidden.status, stats_forbidden.status, stats
+
+    statuses, forbidden, stats_forbidden, stats = asyncio.run(main())
+    assert statuses == [200, 200, 503]
+    assert forbidden == stats_forbidden == 403
+    assert stats["rejected"] == 1
+    assert stats["processed"] == 2
+
+
+def test_webhook_mode_always_has_a_secret():
+    assert webhook_secret("configured", "https://example.com/telegram") == "configured"
+    generated = webhook_secret("", "https://example.com/telegram")
+    assert len(generated) >= 32 and generated != webhook_secret("", "https://example.com/telegram")
+    with pytest.raises(ValueError):
+        webhook_secret("", "")
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from collections import deque
+from aiohttp import web
+from telegram import Update
+from broadcast import _percentile
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret(secret, url):
+    """Return the secret a webhook listener should require.
+
+    When the bot registers `url` itself it can pick a random secret for the
+    run; otherwise one must be configured, since an open listener would take
+    updates from anyone.
+    """
+    if secret:
+        return secret
+    if url:
+        return secrets.token_urlsafe(32)
+    raise ValueError("Webhook mode needs WEBHOOK_SECRET, or WEBHOOK_URL so the bot can register a generated one")
+
+
+class ChatOrderedDispatcher:
+    """Bounded update queue processed concurrently across chats.
+
+    Each chat gets its own mailbox drained by a single task, so updates from
+    one chat run in arrival order while different chats run in parallel, up
+    to `concurrency` at a time. At most `max_pending` updates are buffered;
+    beyond that submit() waits up to `put_timeout` and then rejects, which
+    lets Telegram redeliver later instead of the bot queueing without limit.
+    """
+
+    def __init__(self, process, concurrency=32, max_pending=1000, put_timeout=5.0):
+        self.process = process
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self._slots = asyncio.Semaphore(max_pending)
+        self._workers = asyncio.Semaphore(concurrency)
+        self._mailboxes = {}
+        self._tasks = set()
+        self._waits = deque(maxlen=1000)
+        self.pending = 0
+        self.pending_high = 0
+        self.in_flight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def submit(self, update):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        self.pending += 1
+        self.pending_high = max(self.pending_high, self.pending)
+
+        chat = update.effective_chat
+        key = chat.id if chat else None
+        mailbox = self._mailboxes.get(key)
+        if mailbox is not None:
+            mailbox.append((update, time.monotonic()))
+            return True
+        self._mailboxes[key] = deque([(update, time.monotonic())])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _drain(self, key):
+        mailbox = self._mailboxes[key]
+        while mailbox:
+            update, queued_at = mailbox[0]
+            async with self._workers:
+                self._waits.append(time.monotonic() - queued_at)
+                self.in_flight += 1
+                try:
+                    await self.process(update)
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Failed to process update {update.update_id}: {e}")
+                finally:
+                    self.in_flight -= 1
+            mailbox.popleft()
+            self.pending -= 1
+            self._slots.release()
+        del self._mailboxes[key]
+
+    async def join(self, timeout=None):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    def stats(self):
+        waits = list(self._waits)
+        return {
+            "pending": self.pending,
+            "pending_high": self.pending_high,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "active_chats": len(self._mailboxes),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_wait_p50": _percentile(waits, 50),
+            "queue_wait_p99": _percentile(waits, 99),
+        }
+
+
+class WebhookServer:
+    """aiohttp endpoint that feeds Telegram webhook updates to a dispatcher.
+
+    POST <path> accepts updates; GET <path>/stats returns the dispatcher's
+    backpressure counters as JSON. Both require the secret header when a
+    secret is set.
+    """
+
+    def __init__(self, bot, dispatcher, listen="0.0.0.0", port=8443, path="/telegram", secret=None):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self._runner = None
+
+    def _web_app(self):
+        web_app = web.Application()
+        web_app.router.add_post(self.path, self.handle_update)
+        web_app.router.add_get(f"{self.path.rstrip('/')}/stats", self.handle_stats)
+        return web_app
+
+    def _authorized(self, request):
+        return not self.secret or secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret)
+
+    async def handle_update(self, request):
+        if not self._authorized(request):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        if not await self.dispatcher.submit(update):
+            logger.warning("Update queue full, asking Telegram to retry")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response()
+
+    async def handle_stats(self, request):
+        if not self._authorized(request):
+            return web.Response(status=403)
+        return web.Response(text=json.dumps(self.dispatcher.stats()), content_type="application/json")
+
+    async def start(self):
+        self._runner = web.AppRunner(self._web_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"🌐 Webhook listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None